@@ -0,0 +1,457 @@
+"""Generates velocity profiles for many routes without the prompt
+
+Routes are read from JSON or CSV files, or from every such file in a
+directory, and each one is turned into a path and a velocity profile which
+is saved next to the others in an output directory. Nothing here imports the
+plotting stack, so it runs fine on a headless build server::
+
+    python batch.py routes/ --output profiles/
+
+A JSON route file holds a single route or a list of them::
+
+    {"name": "left-scale",
+     "distance": 0.5,
+     "tolerance": 0.1,
+     "robot": {"width": 2, "velocity": 15, "acceleration": 10},
+     "waypoints": [{"position": [0, 0], "velocity": [10, 0],
+                    "acceleration": [0, 0]}, ...]}
+
+Everything but the waypoints is optional and falls back to the command line
+options. With a tolerance the planning points are spaced adaptively, at
+most distance apart, see :class:`~velocity_profile.VelocityProfile`. A CSV
+route file has one waypoint per row in the form px,py,vx,vy,ax,ay and always
+uses the command line robot, distance and tolerance.
+
+Routes are profiled in parallel over a pool of worker processes, one per core
+unless ``--workers`` says otherwise. With ``--period`` the profiles are
+resampled every period seconds before they're saved, so a control loop
+running at that period reads one row per tick, see
+:func:`~trajectory.resample`. Resampled profiles keep every field, including
+the distance each wheel has traveled, in both output formats, see
+:mod:`profile_io`. The same machinery is available to
+scripts through :func:`~batch.profile_arrays` and :func:`~batch.sweep`, and
+:func:`~batch.sweep_arrays` profiles a sweep finding the planning points of
+each route only once for all of the robots.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from functools import partial
+
+from concurrent.futures import ProcessPoolExecutor
+
+from cache              import ProfileCache
+from path               import from_waypoints
+from profile_io         import save_binary, save_json
+from progress           import silent
+from robot              import Robot
+from spline             import Waypoint
+from trajectory         import INTERPOLATIONS, resample
+from velocity_profile   import VelocityProfile, fleet_profiles
+
+ROUTE_EXTENSIONS = ('.json', '.csv')
+
+class Route(object):
+    """Everything needed to generate a single velocity profile
+
+    Attributes:
+        name (str) : Name of the route, used to name the output file
+        waypoints (list) : The waypoints the path goes through
+        robot (Robot) : The robot that will drive the route
+        distance (float) : Distance between planning points in feet, or the
+            largest distance between them with a tolerance
+        tolerance (float) : Tolerance of adaptive spacing in feet per second,
+            None to space planning points evenly
+
+    """
+    def __init__(self, name, waypoints, robot, distance, tolerance=None):
+        self.name = name
+        self.waypoints = waypoints
+        self.robot = robot
+        self.distance = distance
+        self.tolerance = tolerance
+
+    def profile(self, cache=None, progress=None):
+        """Generates the velocity profile for this route
+
+        Args:
+            cache (ProfileCache) : Where to look for and store the profile,
+                by default it's always computed
+            progress (function) : Where progress is reported, see the
+                progress module
+
+        Returns:
+            VelocityProfile : The profile of the path through the waypoints
+
+        Raises:
+            ValueError : If the route has fewer than two waypoints
+        """
+        if cache is None:
+            path = from_waypoints(self.waypoints)
+            profile = None if path is None else \
+                      VelocityProfile(path, self.robot, self.distance,
+                                      progress, self.tolerance)
+        else:
+            profile = cache.profile(self.waypoints, self.robot, self.distance,
+                                    progress=progress,
+                                    tolerance=self.tolerance)
+
+        if profile is None:
+            raise ValueError("Route " + self.name +
+                             " needs at least two waypoints")
+        return profile
+
+def parse_route(data, name, robot, distance, tolerance=None):
+    """Builds a route from its decoded JSON description
+
+    Args:
+        data (dict) : The decoded route, see the module documentation
+        name (str) : Name to use if the route doesn't give one
+        robot (Robot) : Robot to use if the route doesn't give one
+        distance (float) : Distance to use if the route doesn't give one
+        tolerance (float) : Tolerance to use if the route doesn't give one
+
+    Returns:
+        Route : The described route
+
+    Raises:
+        ValueError : If the description is missing waypoints, a waypoint
+            is missing one of its vectors or the name isn't a plain file
+            name, since it names the route's output file
+    """
+    try:
+        waypoints = [Waypoint(waypoint["position"], waypoint["velocity"],
+                              waypoint["acceleration"])
+                     for waypoint in data["waypoints"]]
+    except (KeyError, TypeError) as err:
+        raise ValueError("Route " + name + " is malformed: " + str(err))
+
+    if "robot" in data:
+        attributes = data["robot"]
+        robot = Robot(attributes.get("width", robot.width),
+                      attributes.get("velocity", robot.max_velocity),
+                      attributes.get("acceleration", robot.max_acceleration))
+
+    name = data.get("name", name)
+    if not isinstance(name, basestring) or name in ("", ".", "..") or \
+       os.path.basename(name) != name or \
+       (os.path.altsep is not None and os.path.altsep in name):
+        raise ValueError("Route name " + repr(name) +
+                         " isn't a plain file name")
+
+    return Route(name, waypoints, robot,
+                 data.get("distance", distance),
+                 data.get("tolerance", tolerance))
+
+def load_routes(filename, robot, distance, tolerance=None):
+    """Reads every route in a JSON or CSV file
+
+    Args:
+        filename (str) : The file to read
+        robot (Robot) : Robot for routes which don't specify their own
+        distance (float) : Distance between planning points for routes which
+            don't specify their own
+        tolerance (float) : Tolerance of adaptive spacing for routes which
+            don't specify their own
+
+    Returns:
+        list : The routes in the file
+
+    Raises:
+        ValueError : If the file can't be parsed or two of its routes have
+            the same name
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+
+    if filename.endswith('.csv'):
+        waypoints = []
+        with open(filename) as source:
+            for row in csv.reader(source):
+                try:
+                    values = [float(value) for value in row]
+                except ValueError:
+                    # Header or comment row
+                    continue
+                if len(values) != 6:
+                    raise ValueError(filename + ": expected 6 values per row")
+                waypoints.append(Waypoint(values[0:2], values[2:4],
+                                          values[4:6]))
+        return [Route(name, waypoints, robot, distance, tolerance)]
+
+    with open(filename) as source:
+        data = json.load(source)
+
+    if not isinstance(data, list):
+        return [parse_route(data, name, robot, distance, tolerance)]
+
+    routes = [parse_route(route, name + "-" + str(index), robot, distance,
+                          tolerance)
+              for index, route in enumerate(data)]
+    names = set()
+    for route in routes:
+        if route.name in names:
+            raise ValueError(filename + ": more than one route is named " +
+                             route.name)
+        names.add(route.name)
+    return routes
+
+def find_route_files(sources):
+    """Expands directories into the route files they contain
+
+    Args:
+        sources (list) : File and directory names
+
+    Returns:
+        list : File names, directories contribute their JSON and CSV files
+        in sorted order
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            for filename in sorted(os.listdir(source)):
+                if filename.endswith(ROUTE_EXTENSIONS):
+                    files.append(os.path.join(source, filename))
+        else:
+            files.append(source)
+    return files
+
+def sweep(routes, robots, distances):
+    """Crosses routes with robot configurations and planning distances
+
+    Args:
+        routes (list) : The routes to sweep over
+        robots (list) : The robots to drive every route with
+        distances (list) : The distances between planning points to try
+
+    Returns:
+        list : A route for every combination, ordered by route, then robot,
+        then distance. Each is named after the original route and the
+        parameters used
+    """
+    combinations = []
+    for route in routes:
+        for robot in robots:
+            for distance in distances:
+                name = "%s-w%g-v%g-a%g-ds%g" % (route.name, robot.width,
+                                                robot.max_velocity,
+                                                robot.max_acceleration,
+                                                distance)
+                combinations.append(Route(name, route.waypoints, robot,
+                                          distance, route.tolerance))
+    return combinations
+
+def _fleet_arrays(job, robots):
+    """Profiles one route for many robots, this runs in the worker processes
+
+    Args:
+        job (Route, float) : The route and the distance between its planning
+            points, the route's own robot is ignored
+        robots (list) : The robots to drive the route with
+
+    Returns:
+        list : An (array, error) pair for every robot, see
+        :func:`~batch._profile_array`
+    """
+    route, distance = job
+    path = from_waypoints(route.waypoints)
+    if path is None:
+        error = "Route " + route.name + " needs at least two waypoints"
+        return [(None, error)] * len(robots)
+    profiles = fleet_profiles(path, robots, distance, silent, route.tolerance)
+    return [(profile.as_array(), None) for profile in profiles]
+
+def sweep_arrays(routes, robots, distances, workers=None):
+    """Profiles every combination :func:`~batch.sweep` gives
+
+    The planning points of each route and distance depend only on the path,
+    so they're found once and shared by the profiles of every robot, see
+    :class:`~velocity_profile.SampledGeometry`. With a tolerance they're
+    placed for the widest and fastest of the robots.
+
+    Args:
+        routes (list) : The routes to sweep over
+        robots (list) : The robots to drive every route with
+        distances (list) : The distances between planning points to try
+        workers (int) : Number of worker processes, defaults to the number of
+            cores. With 1 everything runs in this process
+
+    Returns:
+        list : An (array, error) pair for every route :func:`~batch.sweep`
+        returns, in the same order
+    """
+    jobs = [(route, distance) for route in routes for distance in distances]
+    job = partial(_fleet_arrays, robots=robots)
+    if workers == 1:
+        results = [job(each) for each in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(job, jobs))
+
+    # The jobs are ordered by route then distance, but sweep orders by
+    # route, robot and then distance
+    arrays = []
+    for start in range(0, len(results), len(distances)):
+        for index in range(len(robots)):
+            for fleet in results[start:start + len(distances)]:
+                arrays.append(fleet[index])
+    return arrays
+
+def _profile_array(route, cache_directory=None):
+    """Profiles a single route, this is what runs in the worker processes
+
+    Args:
+        route (Route) : The route to profile
+        cache_directory (str) : Directory of a profile cache shared by the
+            workers, None to always compute the profile
+
+    Returns:
+        (numpy array, str) : The profile packed by
+        :func:`~velocity_profile.VelocityProfile.as_array` and None, or None
+        and the reason the route failed
+    """
+    cache = None
+    if cache_directory is not None:
+        cache = ProfileCache(capacity=1, directory=cache_directory)
+    try:
+        # Bars from several workers would only garble each other
+        return route.profile(cache, silent).as_array(), None
+    except ValueError as err:
+        return None, str(err)
+
+def profile_arrays(routes, workers=None, cache_directory=None):
+    """Profiles many routes in parallel
+
+    The routes are fanned out over a pool of worker processes and only the
+    compact array form of each profile is sent back.
+
+    Args:
+        routes (list) : The routes to profile
+        workers (int) : Number of worker processes, defaults to the number of
+            cores. With 1 everything runs in this process
+        cache_directory (str) : Directory of a profile cache, routes which
+            are unchanged since they were last profiled are read from it
+
+    Returns:
+        list : An (array, error) pair for every route in the same order as
+        routes, see :func:`~batch._profile_array`
+    """
+    job = partial(_profile_array, cache_directory=cache_directory)
+    if workers == 1:
+        return [job(route) for route in routes]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(job, routes))
+
+def parse_args(argv):
+    """Parses the command line
+
+    Args:
+        argv (list) : The command line arguments, without the program name
+
+    Returns:
+        argparse.Namespace : The parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate velocity profiles for many routes at once")
+    parser.add_argument("sources", nargs="+",
+                        help="route files, or directories of route files")
+    parser.add_argument("-o", "--output", default=".",
+                        help="directory to write profiles to")
+    parser.add_argument("--width", type=float, default=2,
+                        help="default robot width in feet")
+    parser.add_argument("--velocity", type=float, default=15,
+                        help="default max velocity in feet per second")
+    parser.add_argument("--acceleration", type=float, default=10,
+                        help="default max acceleration in feet per second "
+                             "squared")
+    parser.add_argument("--distance", type=float, default=0.5,
+                        help="default distance between planning points in "
+                             "feet")
+    parser.add_argument("-t", "--tolerance", type=float, default=None,
+                        help="space planning points adaptively, at most "
+                             "--distance apart, keeping the max velocity "
+                             "within this many feet per second")
+    parser.add_argument("-p", "--period", type=float, default=None,
+                        help="resample profiles every this many seconds, "
+                             "e.g. the period of the control loop")
+    parser.add_argument("-i", "--interpolation", default="linear",
+                        choices=INTERPOLATIONS,
+                        help="how resampled velocities and headings are "
+                             "interpolated")
+    parser.add_argument("-f", "--format", choices=("json", "binary"),
+                        default="json",
+                        help="write JSON profiles, or binary ones as "
+                             "described in the profile_io module")
+    parser.add_argument("-z", "--gzip", action="store_true",
+                        help="gzip JSON profiles")
+    parser.add_argument("-c", "--cache", default=None,
+                        help="directory to cache profiles in, unchanged "
+                             "routes are read from it instead of recomputed")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes, defaults to the "
+                             "number of cores")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Generates and saves the profile of every route given on the command line
+
+    A route which fails doesn't stop the others, but makes the exit status
+    non zero.
+
+    Args:
+        argv (list) : The command line arguments, defaults to sys.argv
+
+    Returns:
+        int : The exit status, 0 if every route succeeded
+    """
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    robot = Robot(options.width, options.velocity, options.acceleration)
+
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+
+    failures = 0
+    routes = []
+    names = set()
+    for filename in find_route_files(options.sources):
+        try:
+            loaded = load_routes(filename, robot, options.distance,
+                                 options.tolerance)
+        except (IOError, ValueError) as err:
+            sys.stderr.write("Skipping " + filename + ": " + str(err) + "\n")
+            failures += 1
+            continue
+        for route in loaded:
+            # Routes are written to files named after them
+            if route.name in names:
+                sys.stderr.write("Skipping " + route.name + " in " + filename +
+                                 ": another route has the same name\n")
+                failures += 1
+                continue
+            names.add(route.name)
+            routes.append(route)
+
+    results = profile_arrays(routes, options.workers, options.cache)
+    for route, (table, error) in zip(routes, results):
+        if error is not None:
+            sys.stderr.write(error + "\n")
+            failures += 1
+            continue
+        if options.period is not None:
+            table = resample(table, options.period, options.interpolation)
+        if options.format == "binary":
+            save_binary(table, os.path.join(options.output,
+                                            route.name + ".bin"))
+        else:
+            extension = ".json.gz" if options.gzip else ".json"
+            save_json(table, os.path.join(options.output,
+                                          route.name + extension))
+
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
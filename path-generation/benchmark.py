@@ -0,0 +1,357 @@
+"""Benchmarks for the geometry and profiling pipeline
+
+Times the stages that dominate profile generation on reproducible, randomly
+generated routes of several sizes and planning distances::
+
+    python benchmark.py                       # run everything
+    python benchmark.py -k profile            # only names containing profile
+    python benchmark.py --save baseline.json  # remember the results
+    python benchmark.py --compare baseline.json
+
+For every benchmark the best wall time per call over a few repeats is
+reported. Fast benchmarks are called enough times in each repeat for it to
+take at least MIN_REPEAT_TIME, so timer resolution and scheduling noise don't
+swamp them. Reported along
+with the number of Python function calls it made (and how many of those went
+to the hot functions in HOT_FUNCTIONS) and the peak memory it allocated. Each
+benchmark runs in a fresh worker process so the memory numbers don't depend
+on what ran before it. When comparing, a benchmark more than the threshold
+slower than the baseline, and slower by more than the noise floor, counts as a
+regression and makes the exit status non zero.
+"""
+
+import argparse
+import cProfile
+import json
+import multiprocessing
+import pstats
+import sys
+import timeit
+
+from collections import namedtuple
+
+import numpy as np
+
+from path             import from_waypoints
+from progress         import silent
+from robot            import Robot
+from spline           import Waypoint
+from velocity_profile import VelocityProfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+# Function names whose call counts are reported on their own
+HOT_FUNCTIONS = ('quad', 'brentq', 'eval', 'eval_many', 'geometry', 'length',
+                 'lengths_at', 'time_at_length', 'times_at_lengths',
+                 'planning_times')
+
+WAYPOINT_COUNTS = (2, 5, 20)
+DISTANCES = (0.5, 0.1, 0.05)
+
+# Least number of seconds each timed repeat runs for
+MIN_REPEAT_TIME = 0.2
+
+# Number of times sampled by the evaluation benchmarks
+SCALAR_SAMPLES = 1000
+BATCH_SAMPLES = 100000
+
+Benchmark = namedtuple('Benchmark', ['name', 'factory', 'args'])
+
+def make_waypoints(count, seed=0):
+    """Generates a reproducible winding route
+
+    Args:
+        count (int) : Number of waypoints
+        seed (int) : Seed for the random number generator
+
+    Returns:
+        list : Waypoints roughly 10 feet apart heading in the +x direction
+    """
+    state = np.random.RandomState(seed)
+    waypoints = []
+    for index in range(count):
+        position = [10. * index, state.uniform(-5, 5)]
+        angle = state.uniform(-np.pi / 4, np.pi / 4)
+        velocity = [10 * np.cos(angle), 10 * np.sin(angle)]
+        waypoints.append(Waypoint(position, velocity, [0, 0]))
+    return waypoints
+
+def construction(count):
+    """Builds every spline of a path"""
+    waypoints = make_waypoints(count)
+    return lambda: from_waypoints(waypoints)
+
+def scalar_eval(count):
+    """Evaluates position, heading and curvature one time at a time"""
+    path = from_waypoints(make_waypoints(count))
+    times = np.linspace(0, 1, SCALAR_SAMPLES).tolist()
+
+    def run():
+        for time in times:
+            path.eval(time)
+            path.heading(time)
+            path.curvature_radius(time)
+    return run
+
+def batched_eval(count):
+    """Evaluates the geometry of the path at many times in one call"""
+    path = from_waypoints(make_waypoints(count))
+    times = np.linspace(0, 1, BATCH_SAMPLES)
+    return lambda: path.geometry(times)
+
+def arc_length(count):
+    """Answers length and time at length queries"""
+    path = from_waypoints(make_waypoints(count))
+    times = np.linspace(0, 1, SCALAR_SAMPLES).tolist()
+    lengths = np.linspace(0, path.total_length, SCALAR_SAMPLES).tolist()
+
+    def run():
+        for time in times:
+            path.length(0, time)
+        for length in lengths:
+            path.time_at_length(length)
+    return run
+
+def planning_points(count, distance):
+    """Generates the planning times of a path"""
+    path = from_waypoints(make_waypoints(count))
+    return lambda: list(path.planning_times(distance))
+
+def profile(count, distance):
+    """Generates a complete velocity profile"""
+    path = from_waypoints(make_waypoints(count))
+    robot = Robot(2, 15, 10)
+
+    return lambda: VelocityProfile(path, robot, distance, silent)
+
+def all_benchmarks():
+    """Every benchmark in the suite, in the order they run
+
+    Returns:
+        list : Benchmark tuples
+    """
+    benchmarks = []
+    for count in WAYPOINT_COUNTS:
+        suffix = " n=%d" % count
+        benchmarks.append(Benchmark("construction" + suffix, construction,
+                                    (count,)))
+        benchmarks.append(Benchmark("scalar_eval" + suffix, scalar_eval,
+                                    (count,)))
+        benchmarks.append(Benchmark("batched_eval" + suffix, batched_eval,
+                                    (count,)))
+        benchmarks.append(Benchmark("arc_length" + suffix, arc_length,
+                                    (count,)))
+    for count in WAYPOINT_COUNTS:
+        for distance in DISTANCES:
+            suffix = " n=%d ds=%g" % (count, distance)
+            benchmarks.append(Benchmark("planning_points" + suffix,
+                                        planning_points, (count, distance)))
+            benchmarks.append(Benchmark("profile" + suffix, profile,
+                                        (count, distance)))
+    return benchmarks
+
+def count_calls(run):
+    """Counts the function calls made by run
+
+    Args:
+        run (function) : The benchmark body
+
+    Returns:
+        dict : The total number of calls under 'total' and the number of calls
+        to each of HOT_FUNCTIONS which was called at all
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    stats = pstats.Stats(profiler)
+    counts = {'total': stats.total_calls}
+    for (_, _, function), entry in stats.stats.items():
+        if function in HOT_FUNCTIONS:
+            counts[function] = counts.get(function, 0) + entry[1]
+    return counts
+
+def peak_memory(run):
+    """Measures the peak memory allocated while running
+
+    Uses tracemalloc where it's available. Otherwise falls back on how much
+    the peak resident size of the process grew, which is only meaningful in a
+    fresh process.
+
+    Args:
+        run (function) : The benchmark body
+
+    Returns:
+        int : Peak memory in bytes
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    run()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux
+    return (after - before) * 1024
+
+def calls_per_repeat(run):
+    """How many times run is called in each timed repeat
+
+    Like timeit's autorange, the number of calls grows through 1, 2, 5, 10,
+    20, ... until a repeat takes at least MIN_REPEAT_TIME.
+
+    Args:
+        run (function) : The benchmark
+
+    Returns:
+        int : Number of calls per repeat
+    """
+    scale = 1
+    while True:
+        for multiple in (1, 2, 5):
+            number = scale * multiple
+            if timeit.timeit(run, number=number) >= MIN_REPEAT_TIME:
+                return number
+        scale *= 10
+
+def run_benchmark(name, repeat):
+    """Runs a single benchmark
+
+    Args:
+        name (str) : Name of the benchmark
+        repeat (int) : Number of timed repeats, the fastest is reported
+
+    Returns:
+        dict : The wall time of one call in seconds, peak memory in bytes and
+        call counts
+    """
+    benchmark = [entry for entry in all_benchmarks() if entry.name == name][0]
+    run = benchmark.factory(*benchmark.args)
+    # Memory first, while the process is still fresh
+    memory = peak_memory(run)
+    number = calls_per_repeat(run)
+    time = min(timeit.repeat(run, number=number, repeat=repeat)) / number
+    return {'time': time, 'memory': memory, 'calls': count_calls(run)}
+
+def run_isolated(name, repeat):
+    """Runs a single benchmark in a fresh worker process
+
+    Args:
+        name (str) : Name of the benchmark
+        repeat (int) : Number of timed runs
+
+    Returns:
+        dict : See :func:`~benchmark.run_benchmark`
+    """
+    pool = multiprocessing.Pool(processes=1)
+    try:
+        return pool.apply(run_benchmark, (name, repeat))
+    finally:
+        pool.close()
+        pool.join()
+
+def format_memory(size):
+    """Formats a number of bytes for the report"""
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.
+    return "%.1f GiB" % size
+
+def report(name, result, baseline=None):
+    """Formats one line of the report
+
+    Args:
+        name (str) : Name of the benchmark
+        result (dict) : The measurements
+        baseline (dict) : Measurements to compare against, if any
+
+    Returns:
+        str : The line
+    """
+    calls = result['calls']
+    hot = ", ".join("%s=%d" % (function, calls[function])
+                    for function in HOT_FUNCTIONS if function in calls)
+    line = "%-32s %10.4fs %12s %10d calls" % (
+        name, result['time'], format_memory(result['memory']), calls['total'])
+    if baseline is not None:
+        line += "  %+6.1f%%" % (100. * (result['time'] / baseline['time'] - 1))
+    return line + ("  (" + hot + ")" if hot else "")
+
+def parse_args(argv):
+    """Parses the command line
+
+    Args:
+        argv (list) : The command line arguments, without the program name
+
+    Returns:
+        argparse.Namespace : The parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark path and profile generation")
+    parser.add_argument("-k", "--filter", default="",
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="timed runs per benchmark, the best is reported")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare",
+                        help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown counted as a regression")
+    parser.add_argument("--noise", type=float, default=0.0005,
+                        help="seconds per call a benchmark has to slow down "
+                             "by before it can count as a regression")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Runs the benchmarks given on the command line
+
+    Args:
+        argv (list) : The command line arguments, defaults to sys.argv
+
+    Returns:
+        int : The exit status, 1 if anything regressed against the baseline
+    """
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as source:
+            baseline = json.load(source)
+
+    results = {}
+    regressions = []
+    for benchmark in all_benchmarks():
+        if options.filter not in benchmark.name:
+            continue
+        result = run_isolated(benchmark.name, options.repeat)
+        results[benchmark.name] = result
+        previous = baseline.get(benchmark.name)
+        print report(benchmark.name, result, previous)
+        sys.stdout.flush()
+        if previous is not None and \
+           result['time'] > previous['time'] * (1 + options.threshold) and \
+           result['time'] - previous['time'] > options.noise:
+            regressions.append(benchmark.name)
+
+    if options.save:
+        with open(options.save, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if regressions:
+        print
+        print "Regressed by more than %g%% and %gs:" % \
+              (100 * options.threshold, options.noise)
+        for name in regressions:
+            print " ", name
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
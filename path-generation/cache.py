@@ -0,0 +1,198 @@
+"""Caches velocity profiles by the inputs that determine them
+
+A profile depends only on the waypoints, the robot's width, max velocity and
+max acceleration, the distance between planning points and the tolerance of
+adaptive spacing, if it's used. Those are hashed
+into a stable key, so asking for the same routine twice, in the same session
+or a later one, returns the stored profile instead of recomputing it.
+
+Profiles are kept in a small in-memory LRU and, if a directory is given, also
+pickled to disk where the least recently used files are evicted once the
+directory grows past a size limit.
+"""
+
+import errno
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+
+from collections import OrderedDict
+
+import numpy as np
+
+from path             import from_waypoints
+from robot            import Robot
+from velocity_profile import VelocityProfile
+
+# Bumped whenever the profile computation changes, so stale profiles on disk
+# are never returned
+KEY_VERSION = b'profile-3'
+
+def profile_key(waypoints, robot, distance, tolerance=None):
+    """A stable hash of everything a velocity profile depends on
+
+    Args:
+        waypoints (list) : The waypoints the path goes through
+        robot (Robot) : The robot driving the path
+        distance (float) : Distance between planning points
+        tolerance (float) : Tolerance of adaptive spacing, None for planning
+            points a fixed distance apart
+
+    Returns:
+        str : A hex digest, equal for equal inputs across runs and machines
+    """
+    digest = hashlib.sha1(KEY_VERSION)
+    digest.update(struct.pack('<Q', len(waypoints)))
+    for waypoint in waypoints:
+        for vector in (waypoint.position, waypoint.velocity,
+                       waypoint.acceleration):
+            vector = np.ascontiguousarray(vector, dtype='<f8')
+            digest.update(struct.pack('<Q', vector.size))
+            digest.update(vector.tobytes())
+    digest.update(struct.pack('<4d', robot.width, robot.max_velocity,
+                              robot.max_acceleration, distance))
+    if tolerance is not None:
+        digest.update(struct.pack('<d', tolerance))
+    return digest.hexdigest()
+
+class ProfileCache(object):
+    """An LRU cache of velocity profiles with an optional store on disk
+
+    Attributes:
+        capacity (int) : Number of profiles kept in memory
+        directory (str) : Where profiles are stored on disk, None to only
+            cache in memory
+        max_bytes (int) : Size the disk store is trimmed down to
+
+    """
+    def __init__(self, capacity=16, directory=None, max_bytes=256 * 2**20):
+        self.capacity = capacity
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.__memory = OrderedDict()
+        if directory is not None:
+            # Batch workers sharing the store may all create it at once
+            try:
+                os.makedirs(directory)
+            except OSError as err:
+                if err.errno != errno.EEXIST or not os.path.isdir(directory):
+                    raise
+
+    def __filename(self, key):
+        """Where the profile with the given key is stored on disk"""
+        return os.path.join(self.directory, key + '.pickle')
+
+    def __remember(self, key, profile):
+        """Puts a profile in the in-memory LRU, evicting the oldest"""
+        self.__memory[key] = profile
+        while len(self.__memory) > self.capacity:
+            self.__memory.popitem(last=False)
+
+    def get(self, key):
+        """Looks up a profile
+
+        Args:
+            key (str) : A key from :func:`~cache.profile_key`
+
+        Returns:
+            VelocityProfile : The cached profile, or None if there isn't one
+        """
+        if key in self.__memory:
+            profile = self.__memory.pop(key)
+            self.__memory[key] = profile
+            return profile
+
+        if self.directory is None:
+            return None
+
+        filename = self.__filename(key)
+        try:
+            with open(filename, 'rb') as source:
+                profile = pickle.load(source)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Touch the file so the disk store evicts by last use. Another
+        # process sharing the store may have evicted it since it was read,
+        # which doesn't matter as the profile is already loaded
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        self.__remember(key, profile)
+        return profile
+
+    def put(self, key, profile):
+        """Stores a profile
+
+        Args:
+            key (str) : A key from :func:`~cache.profile_key`
+            profile (VelocityProfile) : The profile to store
+        """
+        self.__remember(key, profile)
+        if self.directory is None:
+            return
+
+        # Write to a temporary file first so concurrent readers, e.g. other
+        # batch workers, never see a partial profile
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as output:
+            pickle.dump(profile, output, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self.__filename(key))
+        self.__evict()
+
+    def __evict(self):
+        """Removes the least recently used files until under max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def profile(self, waypoints, robot, distance, progress=None,
+                tolerance=None):
+        """Returns the profile for the given inputs, computing it if needed
+
+        Args:
+            waypoints (list) : The waypoints the path goes through
+            robot (Robot) : The robot driving the path
+            distance (float) : Distance between planning points
+            progress (function) : Where progress is reported if the profile
+                has to be computed, see the progress module
+            tolerance (float) : Tolerance of adaptive spacing, see
+                :class:`~velocity_profile.VelocityProfile`
+
+        Returns:
+            VelocityProfile : The profile, or None if there are fewer than
+            two waypoints
+        """
+        key = profile_key(waypoints, robot, distance, tolerance)
+        profile = self.get(key)
+        if profile is None:
+            path = from_waypoints(waypoints)
+            if path is None:
+                return None
+            # The profile keeps a copy of the robot, so later changes to the
+            # caller's robot don't change what the cached profile reports
+            robot = Robot(robot.width, robot.max_velocity,
+                          robot.max_acceleration)
+            profile = VelocityProfile(path, robot, distance, progress,
+                                      tolerance)
+            self.put(key, profile)
+        return profile
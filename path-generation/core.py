@@ -1,15 +1,17 @@
 """Provides the user interface and main loop for path-generation"""
 
-import json
+import argparse
 import cmd
 
 import numpy as np
 
+from cache              import ProfileCache, profile_key
 from path               import from_waypoints
+from profile_io         import save_binary, save_json
 from robot              import Robot
 from spline             import Waypoint
-from visualize          import Visualizer
-from velocity_profile   import VelocityProfile, ProfileEncoder
+from spline             import from_waypoints as join_waypoints
+from velocity_profile   import VelocityProfile
 
 
 INTRO_MESSAGE = "Hello, type help to see list of commands"
@@ -24,18 +26,48 @@ class Prompt(cmd.Cmd):
         waypoints : A list of waypoints which define the path
         path : The path the robot will drive
         robot : The robot that will have to follow the path
-        visualize : The visualizer which displays the path and profiles
+        visualize : The visualizer which displays the path and profiles,
+            None until the plots are first shown
+        display (bool) : Whether plots can be shown at all, without a
+            display the plotting libraries are never imported
         profile : The numerical velocity profile
+        geometry : The planning points of the last profile computed, reused
+            while only the robot's limits change, see
+            :class:`~velocity_profile.SampledGeometry`
+        edit : The splines replaced since the last profile was computed, as
+            the (start, stop, count) Path.splice was given, or None
+        cache : Previously computed profiles, see :mod:`cache`
 
     """
-    def __init__(self):
+    def __init__(self, cache_directory=None, display=True):
         self.waypoints = []
         self.profile = None
+        self.geometry = None
+        self.edit = None
         self.path = None
         self.robot = Robot(2, 15, 10)
-        self.visualize = Visualizer(self.path, offset=self.robot.width/2.)
+        self.cache = ProfileCache(directory=cache_directory)
+        self.display = display
+        self.visualize = None
         cmd.Cmd.__init__(self)
 
+    def visualizer(self):
+        """The visualizer, created the first time it's needed
+
+        Matplotlib and seaborn take a while to import, so they are only
+        loaded once there's something to show.
+
+        Returns:
+            Visualizer : The visualizer, drawing the current path and profile
+        """
+        if self.visualize is None:
+            from visualize import Visualizer
+            self.visualize = Visualizer(self.path,
+                                        offset=self.robot.width/2.)
+            if self.profile is not None:
+                self.visualize.draw_velocity_profile(self.profile)
+        return self.visualize
+
     def update_robot(self, attribute, value):
         """Updates one of the robots attributes
 
@@ -47,10 +79,10 @@ class Prompt(cmd.Cmd):
             self.robot.width = value
             print " Set width to", value, "feet"
         elif attribute == "velocity":
-            self.robot.velocity = value
+            self.robot.max_velocity = value
             print " Set velocity to", value, "feet per second"
         elif attribute == "acceleration":
-            self.robot.acceleration = value
+            self.robot.max_acceleration = value
             print " Set acceleration to", value, "feet per second squared"
         else:
             print " Could not recognize attribute:", attribute
@@ -81,18 +113,101 @@ class Prompt(cmd.Cmd):
 
         This is meant to be called by the waypoint remove command. It parses
         the index into an integer (hopefully) and then removes the waypoint.
+        Only the splines on either side of the waypoint are touched, they are
+        replaced by a single spline joining its neighbours.
 
         Args:
             index: The index of the waypoint to be removed, 0 indexed.
+
+        Returns:
+            bool: True if a waypoint was removed
         """
 
         try:
-            index = int(index)
-            del self.waypoints[index]
-            self.path = from_waypoints(self.waypoints)
-            self.update_path()
+            index = range(len(self.waypoints))[int(index)]
         except ValueError:
             print " Could not parse", index
+            return False
+        except IndexError:
+            print " No waypoint", index
+            return False
+
+        del self.waypoints[index]
+        if len(self.waypoints) < 2:
+            self.path = None
+            self.geometry = None
+        elif index == 0:
+            self.splice_path(0, 1, [])
+        elif index == len(self.waypoints):
+            self.splice_path(index - 1, index, [])
+        else:
+            spline = join_waypoints(self.waypoints[index - 1],
+                                    self.waypoints[index])
+            self.splice_path(index - 1, index + 1, [spline])
+        return True
+
+    def set_waypoint(self, index, position, velocity, acceleration):
+        """Replaces a waypoint
+
+        This is meant to be called by the waypoint set command. Only the
+        splines on either side of the waypoint are rebuilt, and the next
+        compute only finds planning points on them again.
+
+        Args:
+            index (str): The index of the waypoint to replace, 0 indexed
+            position (str): The new position, parsable by
+                :func:`~core.Prompt.parse_vector`
+            velocity (str): The new velocity, see position
+            acceleration (str): The new acceleration, see position
+
+        Returns:
+            bool: True if the waypoint was replaced
+        """
+        try:
+            index = range(len(self.waypoints))[int(index)]
+            waypoint = Waypoint(self.parse_vector(position),
+                                self.parse_vector(velocity),
+                                self.parse_vector(acceleration))
+        except ValueError as err:
+            print " Could not parse:", err
+            return False
+        except IndexError:
+            print " No waypoint", index
+            return False
+
+        print " Setting waypoint", index, "to:"
+        print waypoint
+        self.waypoints[index] = waypoint
+        if self.path is not None:
+            start = max(index - 1, 0)
+            stop = min(index + 1, len(self.waypoints) - 1)
+            self.splice_path(start, stop,
+                             [join_waypoints(self.waypoints[spline],
+                                             self.waypoints[spline + 1])
+                              for spline in range(start, stop)])
+        return True
+
+    def splice_path(self, start, stop, splines):
+        """Replaces some of the path's splines and remembers the edit
+
+        Successive edits are merged into the smallest run of splines
+        covering all of them, in terms of the path the last profile was
+        computed on.
+
+        Args:
+            start (int): Index of the first spline to replace
+            stop (int): Index after the last spline to replace
+            splines (list): The splines to put in their place
+        """
+        self.path.splice(start, stop, splines)
+        count = len(splines)
+        if self.edit is not None:
+            first, last, added = self.edit
+            low = min(first, start)
+            high = max(first + added, stop)
+            count += high - low - (stop - start)
+            start, stop = low, high - added + (last - first)
+        self.edit = (start, stop, count)
 
     @staticmethod
     def parse_vector(vector):
@@ -113,7 +228,7 @@ class Prompt(cmd.Cmd):
                 an array
         """
         try:
-            return np.fromstring(vector[1, -1], sep=",")
+            return np.fromstring(vector[1:-1], sep=",")
         except ValueError:
             raise ValueError("Could not parse: " + vector)
 
@@ -131,22 +246,34 @@ class Prompt(cmd.Cmd):
             acceleration (str): Represents the acceleration in 2d space of the
                 waypoint. Should be parsable by
                 :func:`~core.Prompt.parse_vector`
+
+        Returns:
+            bool: True if the waypoint was added
         """
         try:
             position = self.parse_vector(position)
             velocity = self.parse_vector(velocity)
             acceleration = self.parse_vector(acceleration)
-            waypoint = Waypoint(position, velocity, acceleration)
-            print " Adding waypoint:"
-            print waypoint
-            self.waypoints.append(waypoint)
-            self.path = from_waypoints(self.waypoints)
         except ValueError as err:
             print err
+            return False
+
+        waypoint = Waypoint(position, velocity, acceleration)
+        print " Adding waypoint:"
+        print waypoint
+        self.waypoints.append(waypoint)
+        if self.path is None:
+            self.path = from_waypoints(self.waypoints)
+        else:
+            # Only the new last spline needs to be built
+            self.splice_path(self.path.segments, self.path.segments,
+                             [join_waypoints(self.waypoints[-2], waypoint)])
+        return True
 
     def update_path(self):
-        """Updates and redraws the path"""
-        self.visualize.update_path(self.path, offset=self.robot.width/2.)
+        """Updates and redraws the path, if the plots have been shown"""
+        if self.visualize is not None:
+            self.visualize.update_path(self.path, offset=self.robot.width/2.)
 
     def print_waypoints(self):
         """Prints all of the waypoints."""
@@ -162,6 +289,8 @@ class Prompt(cmd.Cmd):
         print " Manipulates the waypoints:"
         print " waypoint : will list waypoints"
         print " waypoint remove n : removes the nth waypoint (0 indexed)"
+        print " waypoint set n (px,py) (vx,vy) (ax,ay) : replaces the nth",\
+              " waypoint, only the profile around it is recomputed"
         print " waypoint add (px,py) (vx,vy) (ay,ax) :",\
               " adds waypoint with position (px,py), velocity (vx,vy),",\
               " and acceleration (ax,ay)"
@@ -175,6 +304,8 @@ class Prompt(cmd.Cmd):
         - waypoint clear : clears all waypoints
         - waypoint remove n : removes the nth waypoint (0 indexed) handled by
         :func:`~core.Prompt.remove_waypoint`
+        - waypoint set n position velocity acceleration : replaces the nth
+        waypoint handled by :func:`~core.Prompt.set_waypoint`
         - waypoint add position velocity acceleration : adds a waypoint with
         the given position, velocity, and acceleration. handled by
         :func:`~core.Prompt.add_waypoint`
@@ -190,22 +321,31 @@ class Prompt(cmd.Cmd):
         else:
             args = None
 
+        changed = False
         if args is None:
             self.print_waypoints()
 
         elif args[0] == "clear" and len(args) == 1:
             del self.waypoints[:]
+            self.path = None
+            self.geometry = None
+            changed = True
 
         elif args[0] == "remove" and len(args) == 2:
-            self.remove_waypoint(args[1])
+            changed = self.remove_waypoint(args[1])
 
         elif args[0] == "add" and len(args) == 4:
-            self.add_waypoint(args[1], args[2], args[3])
+            changed = self.add_waypoint(args[1], args[2], args[3])
+
+        elif args[0] == "set" and len(args) == 5:
+            changed = self.set_waypoint(args[1], args[2], args[3], args[4])
 
         else:
             print " Couldn't parse, try help waypoint for more info"
 
-        self.update_path()
+        # Only redraw when the path actually changed
+        if changed:
+            self.update_path()
 
     @staticmethod
     def help_robot():
@@ -259,12 +399,78 @@ class Prompt(cmd.Cmd):
             print " Could not recogize command try \'help robot\' for more information"
         self.update_path()
 
+    def reusable_geometry(self, distance, tolerance):
+        """The planning points of the last profile, if they still apply
+
+        The planning points only depend on the path, the distance and the
+        tolerance, so while just the robot's limits change they're reused
+        and computing a profile only runs the velocity passes. With adaptive
+        spacing they were placed for the robot at the time, so they're only
+        reused for robots no wider or faster than it. Waypoint edits since
+        are handled by :func:`~core.Prompt.reprofile`.
+
+        Args:
+            distance (float) : Distance between planning points
+            tolerance (float) : Tolerance of adaptive spacing, or None
+
+        Returns:
+            SampledGeometry : The planning points, or None if they have to
+            be found again
+        """
+        geometry = self.geometry
+        if geometry is None or geometry.path is not self.path or \
+           geometry.distance != distance or geometry.tolerance != tolerance:
+            return None
+        if tolerance is not None and \
+           (self.robot.width > geometry.robot.width or
+            self.robot.max_velocity > geometry.robot.max_velocity):
+            return None
+        return geometry
+
+    def reprofile(self, distance, tolerance):
+        """Computes the profile, reusing as much of the last one as it can
+
+        If the planning points can be reused but waypoints were edited since,
+        only the points on the replaced splines are found again. If the robot
+        is also the same the velocities are only recomputed around them, see
+        :func:`~velocity_profile.VelocityProfile.spliced`.
+
+        Args:
+            distance (float) : Distance between planning points
+            tolerance (float) : Tolerance of adaptive spacing, or None
+
+        Returns:
+            VelocityProfile : The profile of the current path and robot
+        """
+        # The profile keeps a copy of the robot, so later changes to the
+        # prompt's robot don't change what it reports
+        robot = Robot(self.robot.width, self.robot.max_velocity,
+                      self.robot.max_acceleration)
+        geometry = self.reusable_geometry(distance, tolerance)
+        if geometry is None:
+            return VelocityProfile(self.path, robot, distance,
+                                   tolerance=tolerance)
+        if self.edit is None:
+            return VelocityProfile.from_geometry(geometry, robot)
+
+        previous = self.profile
+        limits = (robot.width, robot.max_velocity, robot.max_acceleration)
+        if previous is not None and previous.geometry is geometry and \
+           limits == (previous.robot.width, previous.robot.max_velocity,
+                      previous.robot.max_acceleration):
+            return previous.spliced(*self.edit)
+        geometry, _ = geometry.spliced(*self.edit)
+        return VelocityProfile.from_geometry(geometry, robot)
+
     @staticmethod
     def help_compute():
         """Prints the help text for the compute command"""
         print " Computes the velocity profile of currently defined  path."
         print " compute ds : ds is the distance between between planning",\
               " points in feet"
+        print " compute ds tolerance : spaces planning points adaptively,",\
+              " at most ds apart, keeping the max velocity within",\
+              " tolerance feet per second"
 
     def do_compute(self, args):
         """Handles the user input to the copmpute command
@@ -272,22 +478,43 @@ class Prompt(cmd.Cmd):
         Takes all the waypoints currently defined, the path through them,
         and the robot and generates a numerical velocity profile. The details
         of that computation are too long to outline here and are all in the
-        velocity_profile module.
+        velocity_profile module. If the same waypoints, robot and distance
+        have been computed before the cached profile is reused, otherwise as
+        much of the last profile as still applies is, see
+        :func:`~core.Prompt.reprofile`.
 
         Args:
             args (str) : All the text after the 'compute' will be parsed to
                 a floating number representing the distance between planning
-                points
+                points, optionally followed by the tolerance of adaptive
+                spacing
         """
-        if args:
-            try:
-                distance = float(args)
-                self.profile = VelocityProfile(self.path, self.robot, distance)
-                self.visualize.draw_velocity_profile(self.profile)
-            except ValueError:
-                print " Failed to parse", args
-        else:
+        args = args.split()
+        if not args or len(args) > 2:
             print " Failed to parse, try \'help compute\' for more help"
+            return
+
+        try:
+            distance = float(args[0])
+            tolerance = float(args[1]) if len(args) == 2 else None
+        except ValueError:
+            print " Failed to parse", " ".join(args)
+            return
+
+        if self.path is None:
+            print " Add at least two waypoints first"
+            return
+
+        key = profile_key(self.waypoints, self.robot, distance, tolerance)
+        profile = self.cache.get(key)
+        if profile is None:
+            profile = self.reprofile(distance, tolerance)
+            self.cache.put(key, profile)
+        self.profile = profile
+        self.geometry = profile.geometry
+        self.edit = None
+        if self.visualize is not None:
+            self.visualize.draw_velocity_profile(self.profile)
 
     @staticmethod
     def help_show():
@@ -305,35 +532,53 @@ class Prompt(cmd.Cmd):
         """
         if args:
             print "Show does not take arguments"
+        elif not self.display:
+            print " Plots are disabled, restart without --no-display to see them"
         else:
-            self.visualize.show()
+            self.visualizer().show()
 
     @staticmethod
     def help_save():
         """Prints the help text for the save command."""
         print "Saves the current velocity profile."
         print " save [name] : saves to name.json"
+        print " save [name] binary : saves to name.bin in the binary format",\
+              " which the robot can memory map without parsing"
+        print " save [name] gzip : saves to name.json.gz"
 
     def do_save(self, args):
         """"Handles user input for the save command
 
-        Allows the user to save the numerical velocity profile to a json file.
-        At the moment it's very dumb and just dumps it out into same file where
-        this one is located. Moreover it assumes everything after the word
-        'save' is the of the output file.
+        Allows the user to save the numerical velocity profile to a json file,
+        to a gzipped one if the last word is 'gzip' or to a binary file if the
+        last word is 'binary' (see :mod:`profile_io`). At the moment it's very
+        dumb and just dumps it out into same file where this one is located.
+        Moreover it assumes everything else after the word 'save' is the of
+        the output file.
 
         Args:
             args (str) : A string representing all of the user input after
                 'save'
         """
-        if args:
-            name = args + ".json"
+        if self.profile is None:
+            print " Nothing to save, try compute first"
+            return
+
+        words = args.split(' ')
+        form = words[-1] if words[-1] in ("binary", "gzip") else "json"
+        if form != "json":
+            args = ' '.join(words[:-1])
+        if not args:
+            args = "profile"
+
+        if form == "binary":
+            name = args + ".bin"
+            print "saving to", name
+            save_binary(self.profile, name)
         else:
-            name = "profile.jsoin"
-        print "saving to", name
-
-        with open(name, 'w') as output:
-            json.dump(self.profile, output, cls=ProfileEncoder)
+            name = args + (".json.gz" if form == "gzip" else ".json")
+            print "saving to", name
+            save_json(self.profile, name)
 
     @staticmethod
     def help_intro():
@@ -373,7 +618,27 @@ class Prompt(cmd.Cmd):
 
         return True
 
+def parse_args(argv=None):
+    """Parses the command line
+
+    Args:
+        argv (list) : The command line arguments, defaults to sys.argv
+
+    Returns:
+        argparse.Namespace : The parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description="Interactively build paths and velocity profiles")
+    parser.add_argument("--no-display", dest="display", action="store_false",
+                        help="never show plots, for machines without a "
+                             "display")
+    parser.add_argument("-c", "--cache", default=None,
+                        help="directory to cache profiles in between "
+                             "sessions")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
-    PROMPT = Prompt()
+    OPTIONS = parse_args()
+    PROMPT = Prompt(OPTIONS.cache, OPTIONS.display)
     PROMPT.prompt = "> "
     PROMPT.cmdloop(INTRO_MESSAGE)
@@ -0,0 +1,136 @@
+"""Measures where the time goes while generating a velocity profile
+
+A :class:`~instrument.ProfileStats` records how long each stage of profile
+generation took and counts the work done in the hot paths: quadratures
+integrated, Newton steps and brentq iterations taken inverting arc length,
+and spline points evaluated. The geometry code reports that work through
+:func:`~instrument.count`, which only costs a list check when nothing is
+collecting.
+
+The stages can also be exported as a Chrome trace, viewable in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import json
+import os
+
+from contextlib import contextmanager
+from timeit     import default_timer
+
+# The stats currently collecting counts, innermost last
+_ACTIVE = []
+
+def count(name, amount=1):
+    """Adds to a counter of the stats currently collecting, if any
+
+    Args:
+        name (str) : Name of the counter
+        amount (int) : How much to add
+    """
+    if _ACTIVE:
+        _ACTIVE[-1].count(name, amount)
+
+@contextmanager
+def collecting(stats):
+    """Sends every :func:`~instrument.count` made inside to stats
+
+    Args:
+        stats (ProfileStats) : Where the counts go
+    """
+    _ACTIVE.append(stats)
+    try:
+        yield stats
+    finally:
+        _ACTIVE.pop()
+
+class ProfileStats(object):
+    """Stage timings and work counters for one velocity profile
+
+    Attributes:
+        stages (list) : A (name, start, duration) tuple for each stage in the
+            order they ran, times are in seconds
+        counters (dict) : Amount of work done, by name
+
+    """
+    def __init__(self):
+        self.stages = []
+        self.counters = {}
+
+    def count(self, name, amount=1):
+        """Adds to a counter
+
+        Args:
+            name (str) : Name of the counter
+            amount (int) : How much to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code run inside as a stage
+
+        Args:
+            name (str) : Name of the stage
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.stages.append((name, start, default_timer() - start))
+
+    def stage_times(self):
+        """Total time spent in each stage
+
+        Returns:
+            dict : Seconds spent, by stage name
+        """
+        times = {}
+        for name, _, duration in self.stages:
+            times[name] = times.get(name, 0) + duration
+        return times
+
+    def total_time(self):
+        """Total time spent in all stages, in seconds"""
+        return sum(duration for _, _, duration in self.stages)
+
+    def __str__(self):
+        lines = ["Profile Statistics:"]
+        for name, _, duration in self.stages:
+            lines.append(" %-24s %9.4fs" % (name, duration))
+        lines.append(" %-24s %9.4fs" % ("total", self.total_time()))
+        for name in sorted(self.counters):
+            lines.append(" %-24s %10d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """The stages and counters as a Chrome trace
+
+        Returns:
+            dict : A trace in the Chrome trace event format, with a complete
+            event per stage and the counters attached to a final instant
+        """
+        if self.stages:
+            origin = self.stages[0][1]
+            _, start, duration = self.stages[-1]
+            end = start + duration - origin
+        else:
+            origin = end = 0
+        pid = os.getpid()
+        events = []
+        for name, start, duration in self.stages:
+            events.append({"name": name, "cat": "profile", "ph": "X",
+                           "ts": (start - origin) * 1e6,
+                           "dur": duration * 1e6, "pid": pid, "tid": 0})
+        events.append({"name": "counters", "cat": "profile", "ph": "i",
+                       "s": "p", "ts": end * 1e6, "pid": pid,
+                       "tid": 0, "args": dict(self.counters)})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, filename):
+        """Writes the stages and counters as a Chrome trace file
+
+        Args:
+            filename (str) : Where to write the trace
+        """
+        with open(filename, 'w') as output:
+            json.dump(self.chrome_trace(), output)
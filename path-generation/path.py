@@ -1,9 +1,9 @@
 # Contains the implementation of a path which is simply a series of splines
+from bisect          import bisect_right
 from math            import modf
 
-from numpy.linalg    import norm
-from scipy.optimize  import brentq
-from scipy.integrate import quad
+from numpy           import searchsorted, asarray, arange, argsort, empty, \
+                            clip
 
 import spline as s
 
@@ -11,7 +11,13 @@ class Path(object):
     def __init__(self, splines):
         self.splines = splines
         self.segments = len(splines)
-        self.total_length = self.length(0, 1)
+        # The length of each spline and the prefix sums of those
+        # lengths, offsets[i] is the length of the path before spline i
+        self.segment_lengths = [spline.total_length for spline in splines]
+        self.offsets = [0]
+        for length in self.segment_lengths:
+            self.offsets.append(self.offsets[-1] + length)
+        self.total_length = self.offsets[-1]
     # Adds a new spline to the end of the path
     # Worth noting this doesn't care if they agree
     # on their boundary, although the rest of this code will
@@ -19,21 +25,83 @@ class Path(object):
     def stitch(self, spline):
         self.splines.append(spline)
         self.segments += 1
-        self.total_length = self.length(0, 1)
+        self.segment_lengths.append(spline.total_length)
+        self.offsets.append(self.offsets[-1] + spline.total_length)
+        self.total_length = self.offsets[-1]
+
+    # Replaces the splines from start up to (not including) stop with
+    # the given splines. Every other spline keeps its cached length,
+    # the offsets after the change are just shifted
+    def splice(self, start, stop, splines):
+        self.splines[start:stop] = splines
+        self.segment_lengths[start:stop] = [spline.total_length
+                                            for spline in splines]
+        self.segments = len(self.splines)
+        offsets = self.offsets[:start + 1]
+        for length in self.segment_lengths[start:]:
+            offsets.append(offsets[-1] + length)
+        self.offsets = offsets
+        self.total_length = self.offsets[-1]
 
     # Given a time between 0 and 1 this returns the spline this
     # time lands in and the corresponding time to evaluate. This
     # is basically all the logic as then we can just return the
     # splines data at that point
     def __pick_spline(self, t):
+        index, t = self.__pick_index(t)
+        return (self.splines[index], t)
+
+    # Same as __pick_spline but returns the index of the spline
+    def __pick_index(self, t):
         if t >= 1:
-            t -= self.segments - 1
             spline = self.segments-1
+            t = t*self.segments - spline
         elif t <= 0:
             spline = 0
+            t *= self.segments
         else:
             t, spline = modf(t*self.segments)
-        return (self.splines[int(spline)], t)
+        return (int(spline), t)
+
+    # The batched version of __pick_spline, returns the index of the
+    # spline each time lands in and the corresponding local times
+    def __pick_splines(self, times):
+        boundaries = arange(1, self.segments)/float(self.segments)
+        indices = searchsorted(boundaries, times, side='right')
+        return indices, times*self.segments - indices
+
+    # Buckets a flat array of path times by spline with one stable
+    # sort. Yields each spline with the positions of the times that
+    # land in it and their local times
+    def __buckets(self, times):
+        indices, local = self.__pick_splines(times)
+        return self.__group(indices, local)
+
+    # Groups values by the index of the spline they belong to, see
+    # __buckets
+    def __group(self, indices, local):
+        order = argsort(indices, kind='mergesort')
+        bounds = searchsorted(indices[order], arange(self.segments + 1))
+        for index in range(self.segments):
+            chunk = order[bounds[index]:bounds[index + 1]]
+            if len(chunk):
+                yield self.splines[index], chunk, local[chunk]
+
+    # Evaluates the named batch method of the splines at an array of
+    # path times, each spline is evaluated once on all of its times and
+    # the results are written back in the original order
+    def __map_splines(self, method, times):
+        times = asarray(times, dtype=float)
+        results = None
+        for spline, chunk, local in self.__buckets(times.ravel()):
+            values = getattr(spline, method)(local)
+            if results is None:
+                results = empty((times.size,) + values.shape[1:])
+            results[chunk] = values
+
+        if results is None:
+            results = getattr(self.splines[0], method)(times.ravel())
+        return results.reshape(times.shape + results.shape[1:])
 
     def eval(self, t):
         spline, t = self.__pick_spline(t)
@@ -59,23 +127,116 @@ class Path(object):
         spline, t = self.__pick_spline(t)
         return spline.curvature_radius(t)
 
-    def length(self, start, end):
-        return quad(lambda t: norm(self.tangent(t)), start, end)[0]
+    # Batched versions of the methods above, each takes an array of
+    # times between 0 and 1 and returns an array with one entry (or
+    # one row for vectors) per time
+    def eval_many(self, times):
+        return self.__map_splines('eval_many', times)
+
+    def tangent_many(self, times):
+        return self.segments * self.__map_splines('tangent_many', times)
+
+    def unit_tangent_many(self, times):
+        return self.__map_splines('unit_tangent_many', times)
+
+    def unit_normal_many(self, times):
+        return self.__map_splines('unit_normal_many', times)
+
+    def heading_many(self, times):
+        return self.__map_splines('heading_many', times)
+
+    def curvature_radius_many(self, times):
+        return self.__map_splines('curvature_radius_many', times)
+
+    # The position, tangent, unit normal, heading and curvature at a
+    # time or array of times, see Spline.geometry
+    def geometry(self, times):
+        times = asarray(times, dtype=float)
+        fields = None
+        for spline, chunk, local in self.__buckets(times.ravel()):
+            record = spline.geometry(local)
+            if fields is None:
+                fields = [empty((times.size,) + value.shape[1:])
+                          for value in record]
+            for field, value in zip(fields, record):
+                field[chunk] = value
+
+        if fields is None:
+            fields = self.splines[0].geometry(times.ravel())
+        fields = [field.reshape(times.shape + field.shape[1:])[()]
+                  for field in fields]
+        fields[1] = self.segments * fields[1]
+        return s.Geometry(*fields)
+
+    # Length of the path from time 0 to time t, only the spline t
+    # lands in has to be integrated
+    def __arc_length(self, t):
+        index, local_t = self.__pick_index(t)
+        return self.offsets[index] + self.splines[index].length(0, local_t)
 
-    def __next(self, t, distance):
-        if self.length(0, t) + distance > self.total_length:
-            root = 1
+    def length(self, start, end):
+        return self.__arc_length(end) - self.__arc_length(start)
+
+    # The batched version of __arc_length, the length of the path from
+    # time 0 to each of an array of times
+    def lengths_at(self, times):
+        times = asarray(times, dtype=float)
+        lengths = empty(times.size)
+        offsets = asarray(self.offsets)
+        indices, local = self.__pick_splines(times.ravel())
+        for spline, chunk, local in self.__group(indices, local):
+            lengths[chunk] = offsets[indices[chunk]] + spline.lengths_at(local)
+        return lengths.reshape(times.shape)
+
+    # Time at which the path has covered the given length, clamped to
+    # the ends of the path
+    def time_at_length(self, length):
+        if length <= 0:
+            return 0.
+        if length >= self.total_length:
+            return 1.
+
+        index = min(bisect_right(self.offsets, length), self.segments) - 1
+        spline = self.splines[index]
+        local_t = spline.time_at_length(length - self.offsets[index])
+        return (index + local_t)/float(self.segments)
+
+    # The batched version of time_at_length, each spline finds the times
+    # of all the lengths that land in it at once
+    def times_at_lengths(self, lengths):
+        lengths = asarray(lengths, dtype=float)
+        flat = lengths.ravel()
+        offsets = asarray(self.offsets)
+        indices = searchsorted(offsets, flat, side='right') - 1
+        indices = clip(indices, 0, self.segments - 1)
+        times = empty(flat.size)
+        for spline, chunk, local in self.__group(indices,
+                                                 flat - offsets[indices]):
+            times[chunk] = (indices[chunk] + spline.times_at_lengths(local)) \
+                           / float(self.segments)
+        times[flat <= 0] = 0.
+        times[flat >= self.total_length] = 1.
+        return times.reshape(lengths.shape)
+
+    # Times of points along the path distance apart. If spacing is
+    # given it's called with each planning time and returns how far
+    # away the next point should be, with distance as the upper bound
+    def planning_times(self, distance, spacing=None):
+        yield 0
+        if spacing is None:
+            # Every length is known up front, so they're found at once
+            steps = arange(1, int(self.total_length // distance) + 1)
+            lengths = steps * float(distance)
+            lengths = lengths[lengths < self.total_length]
+            for t in self.times_at_lengths(lengths):
+                yield t
         else:
-            f = lambda x: self.length(t, x) - distance
-            root = brentq(f, t, 1)
-
-        return root
-
-    def planning_times(self, distance):
-        t = 0
-        while t < 1:
-            yield t
-            t = self.__next(t, distance)
+            length = min(distance, spacing(0))
+            t = self.time_at_length(length)
+            while t < 1:
+                yield t
+                length += min(distance, spacing(t))
+                t = self.time_at_length(length)
         yield 1
 
 def from_waypoints(waypoints):
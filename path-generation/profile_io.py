@@ -0,0 +1,259 @@
+"""Reads and writes velocity profiles
+
+Profiles can be saved as JSON with :func:`~profile_io.save_json`, which
+streams the points straight to the file (optionally gzipped) instead of
+building the whole document in memory first. Its output is the same as
+dumping the profile with :class:`~velocity_profile.ProfileEncoder`.
+
+JSON is easy to read by eye but large and slow to parse on the robot
+controller, so there is also a compact binary format. The binary format
+is a 16 byte header followed by one fixed width record per planning point,
+which can be memory mapped and used directly without any parsing.
+
+Header, all little endian:
+
+    ======  ======  ===================================================
+    Offset  Type    Contents
+    ======  ======  ===================================================
+    0       char[4] Magic bytes ``HPRF``
+    4       uint16  Format version, which selects the record layout
+    6       uint16  Size in bytes of each float, 4 or 8
+    8       uint64  Number of records
+    ======  ======  ===================================================
+
+In version 1 each record is the floats time, heading, left velocity and right
+velocity in that order, so a record is 16 bytes at single precision and 32 at
+double. Version 3 appends the position of the robot, x and y, to each record
+and is what profiles are written as unless version 1 is asked for, see
+POSITION_FIELDS. Version 2 holds profiles resampled every control period by
+:func:`~trajectory.resample`, and each record is the floats time, velocity,
+left velocity, right velocity, heading, left distance, right distance, x and
+y, see RESAMPLED_FIELDS. Resampled profiles saved as JSON likewise keep every
+field, named as in RESAMPLED_FIELDS.
+"""
+
+import gzip
+import json
+import struct
+
+import numpy as np
+
+from velocity_profile import VelocityProfile, json_object
+
+MAGIC = b'HPRF'
+VERSION = 1
+RESAMPLED_VERSION = 2
+POSITION_VERSION = 3
+HEADER = struct.Struct('<4sHHQ')
+
+# The fields of every record in the order they are written
+BINARY_FIELDS = ('time', 'heading', 'left_velocity', 'right_velocity')
+
+# The fields of a resampled profile, written in this order by version 2
+RESAMPLED_FIELDS = ('time', 'velocity', 'left_velocity', 'right_velocity',
+                    'heading', 'left_distance', 'right_distance', 'x', 'y')
+
+# The fields of a profile with positions, written in this order by version 3
+POSITION_FIELDS = BINARY_FIELDS + ('x', 'y')
+
+# The fields of the records of each version
+LAYOUTS = {VERSION: BINARY_FIELDS, RESAMPLED_VERSION: RESAMPLED_FIELDS,
+           POSITION_VERSION: POSITION_FIELDS}
+
+# Number of points converted to JSON at a time when streaming
+CHUNK_SIZE = 4096
+
+def _has_fields(profile, fields):
+    """Whether a profile array has every one of the fields"""
+    names = getattr(getattr(profile, 'dtype', None), 'names', None) or ()
+    return all(field in names for field in fields)
+
+def _is_resampled(profile):
+    """Whether a profile was resampled by :func:`~trajectory.resample`"""
+    return _has_fields(profile, RESAMPLED_FIELDS)
+
+def _version(profile):
+    """The version of the binary format holding the most of a profile"""
+    if _is_resampled(profile):
+        return RESAMPLED_VERSION
+    if isinstance(profile, VelocityProfile) or \
+       _has_fields(profile, POSITION_FIELDS):
+        return POSITION_VERSION
+    return VERSION
+
+def _resampled_object(*row):
+    """The saved form of a single row of a resampled profile"""
+    return dict(zip(RESAMPLED_FIELDS, row))
+
+def _saved_columns(profile, fields=BINARY_FIELDS):
+    """The columns that get saved from a profile
+
+    Args:
+        profile (VelocityProfile or numpy array) : A profile, its array
+            form from :func:`~velocity_profile.VelocityProfile.as_array`, or
+            a resampled profile from :func:`~trajectory.resample`
+        fields (tuple) : Names of the columns, see LAYOUTS
+
+    Returns:
+        tuple : An array of every point for each field
+    """
+    if isinstance(profile, VelocityProfile):
+        columns = {'time': profile.external_time,
+                   'heading': profile.heading,
+                   'left_velocity': profile.left_velocity,
+                   'right_velocity': profile.right_velocity,
+                   'x': profile.position[:, 0],
+                   'y': profile.position[:, 1]}
+        return tuple(columns[field] for field in fields)
+    return tuple(profile[field] for field in fields)
+
+def save_json(profile, filename, compress=None):
+    """Streams a profile to a JSON file
+
+    Points are converted and written CHUNK_SIZE at a time, so the memory
+    used doesn't grow with the length of the profile and writing starts
+    immediately.
+
+    Args:
+        profile (VelocityProfile or numpy array) : The profile to save, its
+            array form from :func:`~velocity_profile.VelocityProfile.as_array`
+            or a resampled profile
+        filename (str) : Where to write it
+        compress (bool) : Whether to gzip the output, by default only when
+            filename ends in .gz
+    """
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if _is_resampled(profile):
+        columns = _saved_columns(profile, RESAMPLED_FIELDS)
+        to_json = _resampled_object
+    else:
+        columns = _saved_columns(profile)
+        to_json = json_object
+    count = len(columns[0])
+
+    opener = gzip.open if compress else open
+    with opener(filename, 'wb') as output:
+        output.write(b'[')
+        for start in range(0, count, CHUNK_SIZE):
+            rows = zip(*[column[start:start + CHUNK_SIZE].tolist()
+                         for column in columns])
+            chunk = ', '.join(json.dumps(to_json(*row)) for row in rows)
+            if start:
+                output.write(b', ')
+            output.write(chunk.encode('ascii'))
+        output.write(b']')
+
+def record_dtype(precision, version=VERSION):
+    """The numpy type of a single record
+
+    Args:
+        precision (str) : Either 'float32' or 'float64'
+        version (int) : The format version, see LAYOUTS
+
+    Returns:
+        numpy.dtype : A little endian structured type with one field per
+        entry of the version's layout
+
+    Raises:
+        ValueError : If the precision isn't supported
+    """
+    if precision not in ('float32', 'float64'):
+        raise ValueError("Unsupported precision: " + str(precision))
+    return np.dtype([(field, np.dtype(precision).newbyteorder('<'))
+                     for field in LAYOUTS[version]])
+
+def save_binary(profile, filename, precision='float32', version=None):
+    """Writes a profile in the binary format
+
+    By default resampled profiles are written as version 2 with all of their
+    fields, profiles with positions as version 3 and anything else as
+    version 1.
+
+    Args:
+        profile (VelocityProfile or numpy array) : The profile to save, its
+            array form from :func:`~velocity_profile.VelocityProfile.as_array`
+            or a resampled profile
+        filename (str) : Where to write it
+        precision (str) : Either 'float32' or 'float64'
+        version (int) : The format version to write, e.g. 1 for readers which
+            only know that one, by default the one holding the most of the
+            profile
+
+    Raises:
+        ValueError : If the version is unknown or the profile lacks its
+            fields
+    """
+    if version is None:
+        version = _version(profile)
+    if version not in LAYOUTS:
+        raise ValueError("Unsupported version: " + str(version))
+    if not isinstance(profile, VelocityProfile) and \
+       not _has_fields(profile, LAYOUTS[version]):
+        raise ValueError("The profile doesn't have the fields of version " +
+                         str(version))
+    columns = _saved_columns(profile, LAYOUTS[version])
+    records = np.empty(len(columns[0]), record_dtype(precision, version))
+    for field, column in zip(LAYOUTS[version], columns):
+        records[field] = column
+
+    with open(filename, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, version,
+                                 records.dtype[0].itemsize, len(records)))
+        records.tofile(output)
+
+def read_header(filename):
+    """Reads and checks the header of a binary profile
+
+    Args:
+        filename (str) : The file to read
+
+    Returns:
+        (numpy.dtype, int) : The type of each record and the number of records
+
+    Raises:
+        ValueError : If the file isn't a binary profile this version can read
+    """
+    with open(filename, 'rb') as source:
+        header = source.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError(filename + " is too short to be a binary profile")
+
+    magic, version, itemsize, count = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(filename + " is not a binary profile")
+    if version not in LAYOUTS:
+        raise ValueError(filename + " has unsupported version " +
+                         str(version))
+    if itemsize not in (4, 8):
+        raise ValueError(filename + " has unsupported float size " +
+                         str(itemsize))
+
+    return record_dtype('float32' if itemsize == 4 else 'float64',
+                        version), count
+
+def load_binary(filename, mmap=True):
+    """Loads a binary profile
+
+    Args:
+        filename (str) : The file to read
+        mmap (bool) : If true the records are memory mapped read only instead
+            of being read into memory
+
+    Returns:
+        numpy array : A structured array with one record per planning point
+        and the fields of the file's version, see LAYOUTS
+
+    Raises:
+        ValueError : If the file isn't a binary profile this version can read
+    """
+    dtype, count = read_header(filename)
+    if mmap:
+        if count == 0:
+            return np.empty(0, dtype)
+        return np.memmap(filename, dtype=dtype, mode='r',
+                         offset=HEADER.size, shape=(count,))
+
+    with open(filename, 'rb') as source:
+        source.seek(HEADER.size)
+        return np.fromfile(source, dtype=dtype, count=count)
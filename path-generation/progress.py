@@ -0,0 +1,97 @@
+"""Reports how far along a long computation is
+
+Anything that takes a while, like building a velocity profile, reports its
+progress by calling a progress function with the name of the stage it's in
+and the fraction of that stage which is done, 0 when the stage starts and 1
+when it ends. Any function taking those two arguments can be used, this
+module provides ones that draw a bar on the console, write to a logger or
+do nothing at all.
+
+Progress is reported a bounded number of times per stage, and the reporters
+here rate limit what they write on top of that, so reporting costs next to
+nothing even for profiles with many planning points.
+"""
+
+import logging
+import sys
+
+from timeit import default_timer
+
+def silent(stage, fraction):
+    """Ignores all progress"""
+    pass
+
+def default_progress():
+    """The progress function used when none is given
+
+    Returns:
+        function : A :class:`~progress.ConsoleProgress` if stdout is a
+        terminal, otherwise :func:`~progress.silent`
+    """
+    isatty = getattr(sys.stdout, 'isatty', None)
+    if isatty is not None and isatty():
+        return ConsoleProgress()
+    return silent
+
+class ConsoleProgress(object):
+    """Draws a progress bar for each stage on the console
+
+    Attributes:
+        stream (file) : Where the bar is drawn, defaults to stdout
+        interval (float) : Least number of seconds between redraws of the bar
+        width (int) : Number of characters in the bar
+
+    """
+    def __init__(self, stream=None, interval=0.1, width=30):
+        self.stream = sys.stdout if stream is None else stream
+        self.interval = interval
+        self.width = width
+        self.__last_draw = None
+
+    def __bar(self, fraction):
+        """Draws the bar over whatever bar was there before"""
+        done = int(fraction * self.width)
+        self.stream.write('\r[{0}{1}] {2}%'.format('#' * done,
+                                                   '-' * (self.width - done),
+                                                   int(fraction * 100)))
+        self.__last_draw = default_timer()
+
+    def __call__(self, stage, fraction):
+        if fraction <= 0:
+            self.stream.write(stage.capitalize() + "...\n")
+            self.__last_draw = None
+        elif fraction >= 1:
+            if self.__last_draw is not None:
+                self.__bar(1)
+                self.stream.write("\n")
+            self.stream.write("Done!\n")
+        elif self.__last_draw is None or \
+             default_timer() - self.__last_draw >= self.interval:
+            self.__bar(fraction)
+        else:
+            return
+        self.stream.flush()
+
+class LoggingProgress(object):
+    """Writes progress to a logger
+
+    Attributes:
+        logger (logging.Logger) : Where progress is written
+        level (int) : The level progress is logged at
+        interval (float) : Least number of seconds between messages about
+            the same stage, the start and end of a stage are always logged
+
+    """
+    def __init__(self, logger=None, level=logging.INFO, interval=1.):
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.level = level
+        self.interval = interval
+        self.__last_message = None
+
+    def __call__(self, stage, fraction):
+        now = default_timer()
+        if 0 < fraction < 1 and self.__last_message is not None and \
+           now - self.__last_message < self.interval:
+            return
+        self.__last_message = now
+        self.logger.log(self.level, "%s: %d%%", stage, int(fraction * 100))
@@ -1,16 +1,66 @@
 """Contains the implementation of quintic bezier splines"""
-from math            import acos
-from numpy           import dot, array, clip
+from collections     import namedtuple
+from math            import atan2
+from numpy           import dot, array, linspace, asarray, \
+                            concatenate, cumsum, searchsorted, sqrt, \
+                            arctan2, errstate, where, inf, empty, clip, \
+                            minimum, absolute, isfinite, arange
 from numpy.linalg    import norm
-from scipy.integrate import quad
+from numpy.polynomial.legendre import leggauss
 from scipy.optimize  import brentq
 
+from instrument      import count
+
+# Nodes and weights for gaussian quadrature on [-1, 1], used to integrate the
+# speed of a spline over each interval of its arc length table
+GAUSS_NODES, GAUSS_WEIGHTS = leggauss(5)
+
+# The arc length table is refined until doubling the number of intervals
+# changes no entry by more than this many units
+LENGTH_TOLERANCE = 1e-9
+
+# Bounds on the number of intervals in the arc length table
+MIN_INTERVALS = 8
+MAX_INTERVALS = 4096
+
+# Times found from a length are refined until the length up to them is
+# within this many units of the one asked for, taking at most
+# NEWTON_STEPS steps before falling back on bracketed root finding
+INVERSE_TOLERANCE = 1e-12
+NEWTON_STEPS = 4
+
+class Geometry(namedtuple('Geometry', ['position', 'tangent', 'normal',
+                                       'heading', 'curvature'])):
+    """The local geometry of a curve at a point or batch of points
+
+    Produced by :func:`~spline.Spline.geometry` from a single evaluation of
+    the first and second derivative. For a batch each field has one entry
+    (or one row for vectors) per time.
+
+    Attributes:
+        position (numpy array) : The point on the curve
+        tangent (numpy array) : The derivative of the curve
+        normal (numpy array) : The unit normal of the curve
+        heading (float) : Heading in radians counter clockwise off the x-axis
+        curvature (float) : The signed curvature
+
+    """
+    __slots__ = ()
+
+    @property
+    def radius(self):
+        """The signed radius of curvature, +inf where the curvature is 0"""
+        with errstate(divide='ignore'):
+            return where(self.curvature == 0, inf, 1 / self.curvature)[()]
+
 class Spline(object):
     """Quintic bezier spline implementation
 
     Attributes:
         coeffecients : The vector of coeffecients for the polynomial
         total_length : The length of the entire spline
+        knots : Times between 0 and 1 at which the arc length is tabulated
+        arc_lengths : Length of the spline from time 0 to each knot
 
     """
     def __init__(self, p_0, p_1, p_2, p_3, p_4, p_5):
@@ -27,7 +77,21 @@ class Spline(object):
         self.coeffecients.append(-1 * p_0 +  5 * p_1 - 10 * p_2 + 10 * p_3 - \
                                  5  * p_4 + p_5)
 
-        self.total_length = self.length(0, 1)
+        # The coeffecients along with those of the first and second
+        # derivative as matrices, used to evaluate the spline at many times
+        # at once
+        self.__coeffecient_matrix = array(self.coeffecients, dtype=float)
+        self.__derivative_coeffecients = array(
+            [power * self.coeffecients[power] for power in range(1, 6)],
+            dtype=float)
+        self.__double_derivative_coeffecients = array(
+            [power * (power - 1) * self.coeffecients[power]
+             for power in range(2, 6)], dtype=float)
+
+        self.knots, self.arc_lengths = self.__build_length_table()
+        self.total_length = self.arc_lengths[-1]
+        # The speed at each knot, the derivative of length by time there
+        self.__knot_speeds = self.__speed(self.knots)
 
     # The parameter functions when dotted with our coeffecient matrix
     # will produce the 0th, 1st, and 2nd derivative respectively
@@ -98,6 +162,7 @@ class Spline(object):
         Returns:
             numpy array : The result of evaluation
         """
+        count('spline_evaluations')
         return dot(self.__parameter(time), self.coeffecients)
 
     def __derivative(self, time):
@@ -114,6 +179,7 @@ class Spline(object):
         Returns:
             numpy array : The result of evaluating the derivative
         """
+        count('spline_evaluations')
         return dot(self.__dparameter(time), self.coeffecients)
 
     def __double_derivative(self, time):
@@ -130,6 +196,7 @@ class Spline(object):
         Returns:
             numpy array : The result of evaluating the second derivative
         """
+        count('spline_evaluations')
         return dot(self.__ddparameter(time), self.coeffecients)
 
     def __curvature(self, time):
@@ -143,10 +210,11 @@ class Spline(object):
         Returns:
             float : The signed curvature at the point time
         """
-        term_1 = self.__derivative(time)[0] * self.__double_derivative(time)[1]
-        term_2 = self.__derivative(time)[1] * self.__double_derivative(time)[0]
-        term_3 = (self.__derivative(time)[0] ** 2) + \
-                 (self.__derivative(time)[1] ** 2)
+        first = self.__derivative(time)
+        second = self.__double_derivative(time)
+        term_1 = first[0] * second[1]
+        term_2 = first[1] * second[0]
+        term_3 = (first[0] ** 2) + (first[1] ** 2)
         return (term_1 - term_2)/(term_3 ** 1.5)
 
     def tangent(self, time):
@@ -172,7 +240,8 @@ class Spline(object):
         Returns:
             numpy array : Tangent vector at point in time
         """
-        return self.tangent(time)/norm(self.tangent(time))
+        tangent = self.tangent(time)
+        return tangent/norm(tangent)
 
     def heading(self, time):
         """Returns the heading of the robot
@@ -180,15 +249,15 @@ class Spline(object):
         Given a point in time return the heading of the robot. The heading is
         measured in radians and is given counter clockwise off of the x-axis,
         i.e. a tangent vector of (1,0) corresponds to a heading of 0 while
-        (0,1) is a heading of pi/4.
+        (0,1) is a heading of pi/2 and (0,-1) is a heading of -pi/2.
 
         Args:
             time (float) : Time between 0 and 1
         Returns:
-            float : Heading in radians
+            float : Heading in radians between -pi and pi
         """
-        x = dot(self.unit_tangent(time), [1, 0])
-        return acos(clip(x, -1, 1))
+        tangent = self.tangent(time)
+        return atan2(tangent[1], tangent[0])
 
     def unit_normal(self, time):
         """Calculates unit normal at point in time
@@ -217,17 +286,273 @@ class Spline(object):
         Returns:
             float : Signed radius of curvature
         """
-        try:
-            radius = 1/self.__curvature(time)
-        except ValueError:
-            radius = float('Inf')
-        return radius
+        curvature = self.__curvature(time)
+        if curvature == 0:
+            return float('Inf')
+        return 1/curvature
+
+    @staticmethod
+    def __horner(coeffecients, times):
+        """Evaluates a polynomial at many times at once with Horner's method
+
+        Args:
+            coeffecients (numpy array) : An n x 2 matrix whose kth row is the
+                coeffecient of t^k
+            times (numpy array) : Times to evaluate the polynomial at
+        Returns:
+            numpy array : An array with one row per time holding the value of
+            the polynomial at that time
+        """
+        times = asarray(times, dtype=float)[..., None]
+        count('spline_evaluations', times.size)
+        result = empty(times.shape[:-1] + (2,))
+        result[...] = coeffecients[-1]
+        for coeffecient in coeffecients[-2::-1]:
+            result *= times
+            result += coeffecient
+        return result
+
+    def eval_many(self, times):
+        """Evaluates the curve at many points in time
+
+        The batched version of :func:`~spline.Spline.eval`.
+
+        Args:
+            times (numpy array) : Time values between 0 and 1
+        Returns:
+            numpy array : An N x 2 array, the ith row is the spline at times[i]
+        """
+        return self.__horner(self.__coeffecient_matrix, times)
+
+    def tangent_many(self, times):
+        """Gives the tangent vector at many points in time
+
+        The batched version of :func:`~spline.Spline.tangent`.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : An N x 2 array of tangent vectors
+        """
+        return self.__horner(self.__derivative_coeffecients, times)
+
+    def double_derivative_many(self, times):
+        """Evaluates the second derivative at many points in time
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : An N x 2 array of second derivatives
+        """
+        return self.__horner(self.__double_derivative_coeffecients, times)
+
+    def unit_tangent_many(self, times):
+        """Gives the unit tangent vector at many points in time
+
+        The batched version of :func:`~spline.Spline.unit_tangent`.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : An N x 2 array of unit tangent vectors
+        """
+        tangent = self.tangent_many(times)
+        return tangent / norm(tangent, axis=-1)[..., None]
+
+    def heading_many(self, times):
+        """Returns the heading of the robot at many points in time
+
+        The batched version of :func:`~spline.Spline.heading`.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : Headings in radians
+        """
+        tangent = self.tangent_many(times)
+        return arctan2(tangent[..., 1], tangent[..., 0])
+
+    def unit_normal_many(self, times):
+        """Calculates the unit normal at many points in time
+
+        The batched version of :func:`~spline.Spline.unit_normal`.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : An N x 2 array of unit normal vectors
+        """
+        return dot(self.unit_tangent_many(times), [[0, 1], [-1, 0]])
+
+    def curvature_many(self, times):
+        """Computes the signed curvature at many points in time
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : The signed curvature at each time, nan where the
+            spline stops, i.e. at an end with no velocity
+        """
+        first = self.tangent_many(times)
+        second = self.double_derivative_many(times)
+        cross = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+        with errstate(divide='ignore', invalid='ignore'):
+            return cross / ((first ** 2).sum(axis=-1) ** 1.5)
+
+    def curvature_radius_many(self, times):
+        """Returns the signed radius of curvature at many points in time
+
+        The batched version of :func:`~spline.Spline.curvature_radius`, times
+        with 0 curvature get a radius of +inf and times where the spline
+        stops get nan.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : Signed radius of curvature at each time
+        """
+        curvature = self.curvature_many(times)
+        with errstate(divide='ignore', invalid='ignore'):
+            return where(curvature == 0, inf, 1 / curvature)
+
+    def geometry(self, times):
+        """Computes the local geometry of the spline at a point or batch
+
+        Evaluates the first and second derivative once and derives the unit
+        normal, heading and curvature from them, which is several times
+        cheaper than calling :func:`~spline.Spline.unit_normal`,
+        :func:`~spline.Spline.heading` and
+        :func:`~spline.Spline.curvature_radius` separately.
+
+        Args:
+            times (float or numpy array) : Times between 0 and 1
+        Returns:
+            Geometry : Position, tangent, unit normal, heading and signed
+            curvature at each time
+        """
+        first = self.tangent_many(times)
+        second = self.double_derivative_many(times)
+        speed = norm(first, axis=-1)
+        normal = dot(first / speed[..., None], [[0, 1], [-1, 0]])
+        heading = arctan2(first[..., 1], first[..., 0])
+        cross = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+        return Geometry(self.eval_many(times), first, normal, heading,
+                        cross / speed ** 3)
+
+    def __speed(self, times):
+        """Computes the speed of the spline at many times at once
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : The norm of the derivative at each time
+        """
+        velocity = self.tangent_many(times)
+        return sqrt((velocity ** 2).sum(axis=-1))
+
+    def __quadrature(self, start, end):
+        """Integrates the speed of the spline between start and end
+
+        Uses a single application of gaussian quadrature, which is only
+        accurate when start and end lie in the same interval of the arc length
+        table. Both arguments may be arrays of the same shape.
+
+        Args:
+            start (float) : Starting time
+            end (float) : Ending time
+        Returns:
+            float : Approximate length of the spline between start and end
+        """
+        start = asarray(start, dtype=float)
+        end = asarray(end, dtype=float)
+        count('quadratures', max(start.size, end.size))
+        half = (end - start) / 2.
+        nodes = half[..., None] * GAUSS_NODES + ((start + end) / 2.)[..., None]
+        return half * dot(self.__speed(nodes), GAUSS_WEIGHTS)
+
+    def __length_table(self, intervals):
+        """Tabulates the arc length of the spline on an even grid
+
+        Args:
+            intervals (int) : Number of intervals to split [0, 1] into
+        Returns:
+            (numpy array, numpy array) : The knots and the length of the
+            spline from time 0 to each knot
+        """
+        knots = linspace(0, 1, intervals + 1)
+        pieces = self.__quadrature(knots[:-1], knots[1:])
+        return knots, concatenate(([0.], cumsum(pieces)))
+
+    def __build_length_table(self):
+        """Builds the arc length table used to answer length queries
+
+        The number of intervals is doubled until doing so no longer changes
+        any tabulated length by more than LENGTH_TOLERANCE, so every entry of
+        the table is within that tolerance of the true arc length.
+
+        Returns:
+            (numpy array, numpy array) : The knots and the length of the
+            spline from time 0 to each knot
+        """
+        intervals = MIN_INTERVALS
+        knots, lengths = self.__length_table(intervals)
+        while intervals < MAX_INTERVALS:
+            finer_knots, finer_lengths = self.__length_table(2 * intervals)
+            error = abs(finer_lengths[::2] - lengths).max()
+            knots, lengths = finer_knots, finer_lengths
+            intervals *= 2
+            if error <= LENGTH_TOLERANCE:
+                break
+        return knots, lengths
+
+    def __interval(self, time):
+        """Finds the interval of the arc length table containing time
+
+        Args:
+            time (float) : Time, times outside of [0, 1] are assigned to the
+                first or last interval
+        Returns:
+            int : Index of the knot at the start of the interval
+        """
+        index = searchsorted(self.knots, time, side='right') - 1
+        return min(max(index, 0), len(self.knots) - 2)
+
+    def __arc_length(self, time):
+        """Length of the spline from time 0 to the given time
+
+        Looks up the nearest knot in the arc length table and only integrates
+        the remaining piece of the interval.
+
+        Args:
+            time (float) : Time between 0 and 1
+        Returns:
+            float : Length of the spline between 0 and time
+        """
+        index = self.__interval(time)
+        return self.arc_lengths[index] + \
+               float(self.__quadrature(self.knots[index], time))
+
+    def lengths_at(self, times):
+        """Length of the spline from time 0 to each of many times
+
+        The batched version of :func:`~spline.Spline.__arc_length`.
+
+        Args:
+            times (numpy array) : Times between 0 and 1
+        Returns:
+            numpy array : Length of the spline between 0 and each time
+        """
+        times = asarray(times, dtype=float)
+        index = searchsorted(self.knots, times, side='right') - 1
+        index = clip(index, 0, len(self.knots) - 2)
+        return self.arc_lengths[index] + \
+               self.__quadrature(self.knots[index], times)
 
     def length(self, start, end):
         """Computes the length of a segment of the spline
 
-        Using gaussian quadrature numerically computes the length of the spline
-        between start and end.
+        Uses the arc length table built when the spline was constructed, so
+        only the partial intervals at either end need to be integrated.
 
         Args:
             start (float) : Starting time between 0 and 1
@@ -235,30 +560,154 @@ class Spline(object):
         Returns:
             float : length of the splite between points start and end
         """
-        return quad(lambda t: norm(self.tangent(t)), start, end)[0]
+        return self.__arc_length(end) - self.__arc_length(start)
+
+    def __inverse_guess(self, index, lengths):
+        """Estimates the times at which the spline reaches the given lengths
 
-    def __next(self, time, distance):
-        """Finds new time such that the distance away from given time is fixed.
+        Within each interval of the arc length table the time is a smooth
+        function of length whose value and derivative, one over the speed,
+        are known at both knots. The cubic Hermite interpolant of those is
+        accurate to a small fraction of the interval.
+
+        Args:
+            index (numpy array) : Interval of the table each length is in
+            lengths (numpy array) : Lengths from time 0
+        Returns:
+            numpy array : Estimated times, inside their intervals
+        """
+        start = self.knots[index]
+        end = self.knots[index + 1]
+        low = self.arc_lengths[index]
+        width = self.arc_lengths[index + 1] - low
+        with errstate(divide='ignore', invalid='ignore'):
+            u = where(width > 0, (lengths - low) / width, 0.)
+            first = width / self.__knot_speeds[index]
+            last = width / self.__knot_speeds[index + 1]
+        # The slopes are infinite where the spline stops, fall back on
+        # linear interpolation there
+        linear = ~(isfinite(first) & isfinite(last))
+        first = where(linear, end - start, first)
+        last = where(linear, end - start, last)
+        squared = u * u
+        cubed = squared * u
+        times = (2 * cubed - 3 * squared + 1) * start + \
+                (cubed - 2 * squared + u) * first + \
+                (-2 * cubed + 3 * squared) * end + \
+                (cubed - squared) * last
+        return clip(times, start, end)
+
+    def times_at_lengths(self, lengths):
+        """Finds the times at which the spline reaches many lengths at once
+
+        Each time is estimated from the arc length table by
+        :func:`~spline.Spline.__inverse_guess` and polished with Newton
+        steps, each costing one quadrature and one evaluation of the speed,
+        until the length up to it is within INVERSE_TOLERANCE of the one
+        asked for. Any which haven't converged after NEWTON_STEPS, which
+        only happens where the spline nearly stops, are found with brentq.
+        The work per length doesn't grow with the size of the spline.
 
         Args:
-            float (float) : Time between 0 and 1
-            distance (float) : Distance we want to travel from time t
+            lengths (float or numpy array) : Distances along the spline from
+                time 0
         Returns:
-            float : Time t such that distance from time to t is distance
+            numpy array : Time t for each length such that the length from 0
+            to t is that length, lengths outside of the spline are clamped to
+            0 or 1
         """
-        if self.length(0, time) + distance > self.total_length:
-            root = 1
-        else:
-            fun = lambda x: self.length(time, x) - distance
-            root = brentq(fun, time, 1)
+        lengths = asarray(lengths, dtype=float)
+        flat = clip(lengths.ravel(), 0, self.total_length)
+        index = searchsorted(self.arc_lengths, flat, side='right') - 1
+        index = minimum(index, len(self.knots) - 2)
+        start = self.knots[index]
+        end = self.knots[index + 1]
+        times = self.__inverse_guess(index, flat)
+
+        pending = arange(len(flat))
+        for step in range(NEWTON_STEPS + 1):
+            residual = self.arc_lengths[index[pending]] + \
+                       self.__quadrature(start[pending], times[pending]) - \
+                       flat[pending]
+            unconverged = absolute(residual) > INVERSE_TOLERANCE
+            pending = pending[unconverged]
+            residual = residual[unconverged]
+            if not len(pending) or step == NEWTON_STEPS:
+                break
+            count('newton_steps', len(pending))
+            with errstate(divide='ignore', invalid='ignore'):
+                change = residual / self.__speed(times[pending])
+            times[pending] = clip(times[pending] - change, start[pending],
+                                  end[pending])
+
+        for position in pending:
+            times[position] = self.__bracketed_time(index[position],
+                                                    flat[position])
+
+        times[flat <= 0] = 0.
+        times[flat >= self.total_length] = 1.
+        return times.reshape(lengths.shape)
+
+    def __bracketed_time(self, index, length):
+        """Finds the time at which the spline reaches length with brentq
 
+        Args:
+            index (int) : Interval of the arc length table containing length
+            length (float) : Distance along the spline from time 0
+        Returns:
+            float : The time
+        """
+        start = self.knots[index]
+        remaining = length - self.arc_lengths[index]
+        fun = lambda x: float(self.__quadrature(start, x)) - remaining
+        root, result = brentq(fun, start, self.knots[index + 1],
+                              full_output=True)
+        count('brentq_iterations', result.iterations)
         return root
 
+    def time_at_length(self, length):
+        """Finds the time at which the spline has reached a given length
+
+        The single length version of :func:`~spline.Spline.times_at_lengths`.
+
+        Args:
+            length (float) : Distance along the spline from time 0
+        Returns:
+            float : Time t such that the length from 0 to t is length, lengths
+            outside of the spline are clamped to 0 or 1
+        """
+        if length <= 0:
+            return 0.
+        if length >= self.total_length:
+            return 1.
+
+        # The same steps as times_at_lengths on plain floats, which is
+        # several times faster for a single length
+        index = min(searchsorted(self.arc_lengths, length, side='right') - 1,
+                    len(self.knots) - 2)
+        start = self.knots[index]
+        end = self.knots[index + 1]
+        time = float(self.__inverse_guess(index, length))
+        for step in range(NEWTON_STEPS + 1):
+            residual = self.arc_lengths[index] - length + \
+                       float(self.__quadrature(start, time))
+            if abs(residual) <= INVERSE_TOLERANCE:
+                return time
+            if step == NEWTON_STEPS:
+                break
+            count('newton_steps')
+            speed = float(self.__speed(time))
+            if speed == 0:
+                break
+            time = min(max(time - residual / speed, start), end)
+        return self.__bracketed_time(index, length)
+
     def planning_times(self, distance):
         """Generates a list of planning times fixed distance apart
 
         Generates a list of times from 0 to 1 such that the distance from
-        s(t_i) to s(t_{i+1}) along the spline is equal to distance.
+        s(t_i) to s(t_{i+1}) along the spline is equal to distance. All of the
+        times are found at once by :func:`~spline.Spline.times_at_lengths`.
 
         Args:
             distance (float) : The distance between each planning point
@@ -268,10 +717,12 @@ class Spline(object):
             this time along the spline is the given distance.
 
         """
-        time = 0
-        while time < 1:
+        steps = arange(1, int(self.total_length // distance) + 1)
+        lengths = steps * float(distance)
+        lengths = lengths[lengths < self.total_length]
+        yield 0
+        for time in self.times_at_lengths(lengths):
             yield time
-            time = self.__next(time, distance)
         # I'm not sure if you want this behavior, but this will
         # cause the spline to always report it's endpoint as a planning point
         yield 1
@@ -0,0 +1,503 @@
+"""Answers what the robot should be doing at a given time
+
+A velocity profile is a list of planning points spaced by distance, each
+stamped with the time the robot reaches it. A :class:`~trajectory.Trajectory`
+indexes those points by time, so the wheel velocities, heading and position
+at any elapsed time are found by a binary search and a linear interpolation
+between the two surrounding points.
+
+Controllers running at a fixed period can instead take a profile resampled
+onto a uniform time grid by :func:`~trajectory.resample`, one row per tick.
+
+Positions are known for profiles, their array form and binary profiles of
+version 2 or 3, which is what :func:`~profile_io.save_binary` writes. Only
+version 1 files lack them, and those answer with a null x and y.
+
+Trajectories can be built from a profile, its array form, or a binary profile
+file which is memory mapped rather than read, so many of them can be served at
+once without copying. :func:`~trajectory.serve` does exactly that over a local
+socket, answering queries from any number of clients concurrently::
+
+    python trajectory.py profiles/ --socket /tmp/trajectory.sock
+
+Each request is a line holding the name of a profile, the file name without
+its extension, and an elapsed time in seconds. Each response is a line of
+JSON with the fields of :class:`~trajectory.State`, or an "error" field if
+the request couldn't be answered. :class:`~trajectory.TrajectoryClient` speaks
+that protocol.
+"""
+
+import argparse
+import json
+import math
+import os
+import socket
+import sys
+import threading
+
+from collections import namedtuple
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+import numpy as np
+
+from profile_io       import RESAMPLED_FIELDS, load_binary
+from velocity_profile import VelocityProfile
+
+# Extension of the binary profiles served
+PROFILE_EXTENSION = '.bin'
+
+# A profile resampled onto a uniform time grid, the distances are how far
+# each wheel has traveled since the start
+RESAMPLED_DTYPE = np.dtype([(field, float) for field in RESAMPLED_FIELDS])
+
+# The ways values can be interpolated between planning points
+INTERPOLATIONS = ('linear', 'previous', 'nearest', 'pchip')
+
+class State(namedtuple('State', ['time', 'left_velocity', 'right_velocity',
+                                 'heading', 'x', 'y'])):
+    """Where the robot should be and what its wheels should do at a time
+
+    Attributes:
+        time (float) : Elapsed time in seconds, clamped to the profile
+        left_velocity (float) : Velocity of the left wheel
+        right_velocity (float) : Velocity of the right wheel
+        heading (float) : Heading in radians between -pi and pi
+        x (float) : Position of the robot, None if the profile doesn't
+            store positions
+        y (float) : See x
+
+    """
+    __slots__ = ()
+
+def _wrap(angle):
+    """Wraps angles into [-pi, pi)"""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+class Trajectory(object):
+    """A velocity profile indexed by time
+
+    Attributes:
+        times (numpy array) : Time stamp of each planning point, increasing
+        left_velocity (numpy array) : Left wheel velocity at each point
+        right_velocity (numpy array) : Right wheel velocity at each point
+        heading (numpy array) : Heading at each point
+        x (numpy array) : Position of each point, None if unknown
+        y (numpy array) : See x
+        duration (float) : Time the whole profile takes
+
+    """
+    def __init__(self, times, left_velocity, right_velocity, heading,
+                 x=None, y=None):
+        if len(times) == 0:
+            raise ValueError("A trajectory needs at least one point")
+        self.times = times
+        self.left_velocity = left_velocity
+        self.right_velocity = right_velocity
+        self.heading = heading
+        self.x = x
+        self.y = y
+        self.duration = float(times[-1])
+
+    @classmethod
+    def from_profile(cls, profile):
+        """Builds a trajectory from a profile
+
+        Args:
+            profile (VelocityProfile or numpy array) : A profile, its array
+                form from :func:`~velocity_profile.VelocityProfile.as_array`
+                or a binary profile from :func:`~profile_io.load_binary`
+
+        Returns:
+            Trajectory : The trajectory, sharing memory with the profile
+        """
+        if isinstance(profile, VelocityProfile):
+            return cls(profile.external_time, profile.left_velocity,
+                       profile.right_velocity, profile.heading,
+                       profile.position[:, 0], profile.position[:, 1])
+
+        names = profile.dtype.names
+        # Resampling a trajectory without positions leaves them nan
+        if 'x' in names and not (len(profile) and np.isnan(profile['x'][0])):
+            x, y = profile['x'], profile['y']
+        else:
+            x = y = None
+        return cls(profile['time'], profile['left_velocity'],
+                   profile['right_velocity'], profile['heading'], x, y)
+
+    @classmethod
+    def load(cls, filename):
+        """Memory maps a binary profile as a trajectory
+
+        Args:
+            filename (str) : A profile saved by :func:`~profile_io.save_binary`
+
+        Returns:
+            Trajectory : The trajectory
+
+        Raises:
+            ValueError : If the file isn't a binary profile or is empty
+        """
+        return cls.from_profile(load_binary(filename, mmap=True))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __locate(self, times):
+        """Finds the step each time falls in and how far along it is
+
+        Args:
+            times (numpy array) : Elapsed times, clamped to the profile
+
+        Returns:
+            (numpy array, numpy array) : The index of the point starting each
+            step and the fraction of the step done at each time
+        """
+        if len(self.times) == 1:
+            return np.zeros(times.shape, dtype=int), np.zeros(times.shape)
+        index = np.searchsorted(self.times, times, side='right') - 1
+        index = np.clip(index, 0, len(self.times) - 2)
+        start = self.times[index]
+        length = self.times[index + 1] - start
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(length > 0, (times - start) / length, 0.)
+        return index, fraction
+
+    def __interpolate(self, column, index, fraction):
+        """Linearly interpolates a column within each step"""
+        if len(self.times) == 1:
+            return np.asarray(column[index], dtype=float)
+        first = np.asarray(column[index], dtype=float)
+        last = np.asarray(column[np.minimum(index + 1, len(column) - 1)],
+                          dtype=float)
+        return first + (last - first) * fraction
+
+    def query_many(self, times):
+        """Looks up the state of the robot at many times at once
+
+        Args:
+            times (numpy array) : Elapsed times in seconds, times outside of
+                the profile are clamped to its start or end
+
+        Returns:
+            State : Each field is an array with an entry per time
+        """
+        times = np.clip(np.asarray(times, dtype=float), 0, self.duration)
+        index, fraction = self.__locate(times)
+        left = self.__interpolate(self.left_velocity, index, fraction)
+        right = self.__interpolate(self.right_velocity, index, fraction)
+
+        # Interpolate the heading the short way around
+        first = np.asarray(self.heading[index], dtype=float)
+        if len(self.times) > 1:
+            last = np.asarray(self.heading[index + 1], dtype=float)
+            first = _wrap(first + _wrap(last - first) * fraction)
+
+        x = y = None
+        if self.x is not None:
+            x = self.__interpolate(self.x, index, fraction)
+            y = self.__interpolate(self.y, index, fraction)
+        return State(times, left, right, first, x, y)
+
+    def __distances(self, column, index, fraction):
+        """How far a wheel has traveled at each time
+
+        Integrates the linearly interpolated velocity of the wheel, which
+        is exact for the profile since its time stamps assume the
+        velocity changes linearly between points.
+
+        Args:
+            column (numpy array) : Velocity of the wheel at each point
+            index (numpy array) : Step each time falls in
+            fraction (numpy array) : How far along its step each time is
+
+        Returns:
+            numpy array : Distance traveled by each time
+        """
+        velocity = np.asarray(column, dtype=float)
+        if len(velocity) == 1:
+            return np.zeros(fraction.shape)
+        steps = np.diff(np.asarray(self.times, dtype=float))
+        traveled = steps * (velocity[1:] + velocity[:-1]) / 2.
+        start = np.concatenate(([0.], np.cumsum(traveled)))
+        first = velocity[index]
+        last = velocity[index + 1]
+        return start[index] + steps[index] * fraction * \
+               (first + (last - first) * fraction / 2.)
+
+    def resample(self, period, kind='linear'):
+        """Samples the trajectory every period seconds
+
+        Args:
+            period (float) : Seconds between samples, e.g. the period of the
+                control loop
+            kind (str) : How velocities, heading and position are
+                interpolated between planning points, one of INTERPOLATIONS.
+                'previous' holds the value of the last point passed,
+                'nearest' takes the closest point and 'pchip' fits a monotone
+                cubic. Wheel distances are always exact
+
+        Returns:
+            numpy array : A RESAMPLED_DTYPE row per tick, from time 0 to the
+            first tick at or after the end of the profile, where the robot
+            has stopped. Positions are nan if the trajectory has none
+
+        Raises:
+            ValueError : If the period isn't positive or kind is unknown
+        """
+        if not period > 0:
+            raise ValueError("The period must be positive")
+        if kind not in INTERPOLATIONS:
+            raise ValueError("Unknown interpolation: " + str(kind))
+
+        ticks = int(math.ceil(self.duration / period - 1e-9)) + 1
+        table = np.empty(ticks, RESAMPLED_DTYPE)
+        table['time'] = np.arange(ticks) * float(period)
+        times = np.minimum(table['time'], self.duration)
+        index, fraction = self.__locate(times)
+        heading = np.unwrap(np.asarray(self.heading, dtype=float))
+
+        columns = [('left_velocity', self.left_velocity),
+                   ('right_velocity', self.right_velocity),
+                   ('heading', heading)]
+        if self.x is not None:
+            columns += [('x', self.x), ('y', self.y)]
+        else:
+            table['x'] = table['y'] = np.nan
+        for name, column in columns:
+            column = np.asarray(column, dtype=float)
+            if len(column) == 1:
+                values = column[index]
+            elif kind == 'previous':
+                values = column[index + (fraction >= 1)]
+            elif kind == 'linear':
+                values = self.__interpolate(column, index, fraction)
+            elif kind == 'nearest':
+                values = column[index + (fraction >= 0.5)]
+            else:
+                values = self.__pchip(column, times)
+            table[name] = values
+
+        table['heading'] = _wrap(table['heading'])
+        table['velocity'] = (table['left_velocity'] +
+                             table['right_velocity']) / 2.
+        table['left_distance'] = self.__distances(self.left_velocity, index,
+                                                  fraction)
+        table['right_distance'] = self.__distances(self.right_velocity, index,
+                                                   fraction)
+        return table
+
+    def __pchip(self, column, times):
+        """Interpolates a column with a monotone cubic
+
+        Points with the same time stamp, where the robot didn't move, are
+        merged first since the cubic needs increasing times.
+        """
+        # Only needed for this kind of interpolation, and the rest of the
+        # module runs without scipy
+        from scipy.interpolate import PchipInterpolator
+        stamps = np.asarray(self.times, dtype=float)
+        keep = np.concatenate((np.diff(stamps) > 0, [True]))
+        if keep.sum() < 2:
+            return np.full(times.shape, column[-1])
+        return PchipInterpolator(stamps[keep], column[keep])(times)
+
+    def query(self, time):
+        """Looks up the state of the robot at a time
+
+        Args:
+            time (float) : Elapsed time in seconds, clamped to the profile
+
+        Returns:
+            State : The state, with float fields
+        """
+        state = self.query_many(time)
+        return State(*[None if field is None else float(field)
+                       for field in state])
+
+class _TrajectoryHandler(socketserver.StreamRequestHandler):
+    """Answers the queries of one client, one line at a time"""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            reply = self.server.answer(line.decode('ascii', 'replace'))
+            self.wfile.write(json.dumps(reply).encode('ascii') + b'\n')
+            self.wfile.flush()
+
+class TrajectoryServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    """Serves trajectory queries from a directory of binary profiles
+
+    Every client gets its own thread. Profiles are memory mapped the first
+    time they're asked for and shared by all of the clients.
+
+    Attributes:
+        directory (str) : Where the binary profiles are
+        trajectories (dict) : The profiles loaded so far, by name
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address, directory):
+        socketserver.UnixStreamServer.__init__(self, address,
+                                               _TrajectoryHandler)
+        self.directory = directory
+        self.trajectories = {}
+        self.__lock = threading.Lock()
+
+    def trajectory(self, name):
+        """The trajectory with the given name, loading it if needed
+
+        Args:
+            name (str) : File name of the profile without its extension
+
+        Returns:
+            Trajectory : The trajectory
+
+        Raises:
+            ValueError : If there's no such profile or it can't be read
+        """
+        if name in self.trajectories:
+            return self.trajectories[name]
+        if os.path.basename(name) != name or name.startswith('.'):
+            raise ValueError("Bad profile name: " + name)
+        filename = os.path.join(self.directory, name + PROFILE_EXTENSION)
+        with self.__lock:
+            if name not in self.trajectories:
+                try:
+                    self.trajectories[name] = Trajectory.load(filename)
+                except (IOError, OSError):
+                    raise ValueError("No profile named " + name)
+        return self.trajectories[name]
+
+    def answer(self, request):
+        """Answers one request line
+
+        Args:
+            request (str) : A profile name and an elapsed time
+
+        Returns:
+            dict : The fields of the state, or an "error" describing why the
+            request couldn't be answered
+        """
+        try:
+            name, time = request.split()
+            time = float(time)
+            if math.isnan(time):
+                raise ValueError
+        except ValueError:
+            return {"error": "Expected a profile name and a time"}
+        try:
+            return dict(self.trajectory(name).query(time)._asdict())
+        except ValueError as err:
+            return {"error": str(err)}
+
+def resample(profile, period, kind='linear'):
+    """Samples a profile every period seconds
+
+    Args:
+        profile (VelocityProfile or numpy array) : Anything
+            :func:`~trajectory.Trajectory.from_profile` takes
+        period (float) : Seconds between samples
+        kind (str) : How values are interpolated, see
+            :func:`~trajectory.Trajectory.resample`
+
+    Returns:
+        numpy array : A RESAMPLED_DTYPE row per tick
+    """
+    return Trajectory.from_profile(profile).resample(period, kind)
+
+def serve(directory, address):
+    """Serves the profiles in a directory until interrupted
+
+    Args:
+        directory (str) : Where the binary profiles are
+        address (str) : Path of the unix socket to listen on, it's removed
+            again when the server stops
+    """
+    if os.path.exists(address):
+        os.remove(address)
+    server = TrajectoryServer(address, directory)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(address)
+
+class TrajectoryClient(object):
+    """Queries a :class:`~trajectory.TrajectoryServer`
+
+    Attributes:
+        address (str) : Path of the server's unix socket
+
+    """
+    def __init__(self, address):
+        self.address = address
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.connect(address)
+        self.__file = self.__socket.makefile('rwb')
+
+    def query(self, name, time):
+        """Asks for the state of the robot on a profile at a time
+
+        Args:
+            name (str) : Name of the profile
+            time (float) : Elapsed time in seconds
+
+        Returns:
+            State : The state
+
+        Raises:
+            ValueError : If the server couldn't answer
+        """
+        self.__file.write(("%s %r\n" % (name, float(time))).encode('ascii'))
+        self.__file.flush()
+        reply = json.loads(self.__file.readline().decode('ascii'))
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        return State(**reply)
+
+    def close(self):
+        """Closes the connection"""
+        self.__file.close()
+        self.__socket.close()
+
+def parse_args(argv):
+    """Parses the command line
+
+    Args:
+        argv (list) : The command line arguments, without the program name
+
+    Returns:
+        argparse.Namespace : The parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve trajectory queries from binary profiles")
+    parser.add_argument("directory",
+                        help="directory of profiles saved in the binary "
+                             "format")
+    parser.add_argument("-s", "--socket", default="trajectory.sock",
+                        help="path of the unix socket to listen on")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Serves the profiles given on the command line until interrupted
+
+    Args:
+        argv (list) : The command line arguments, defaults to sys.argv
+
+    Returns:
+        int : The exit status
+    """
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        serve(options.directory, options.socket)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,171 +1,606 @@
 # Defines a velocity profile, which is the big object we've been
 # working towards.
-from math import sqrt, ceil
+from contextlib import contextmanager
+from copy       import copy
+from math       import ceil
 
 import json
 
-class PlanningPoint(object):
+from numpy import array, zeros, concatenate, cumsum, diff, absolute, \
+                  where, errstate, minimum, inf, dtype, empty, ndarray, \
+                  linspace, flatnonzero, floor, arange, isfinite, isnan, \
+                  searchsorted, clip
+from numpy.linalg import norm
+
+from instrument import ProfileStats, collecting
+from progress   import default_progress
+from robot      import Robot
+
+# The columns of a velocity profile, every one is an array with an
+# entry per planning point (position has a row per planning point)
+COLUMNS = ('radius', 'heading', 'position', 'distances', 'internal_time',
+           'external_time', 'max_velocity', 'actual_velocity',
+           'left_velocity', 'right_velocity')
+
+# Number of times progress is reported while finding the planning points
+PROGRESS_STEPS = 100
+
+# With adaptive spacing the next distance of path ahead of each
+# planning point is looked at in LOOKAHEAD pieces, so the closest points
+# get is distance/LOOKAHEAD
+LOOKAHEAD = 64
+
+# The layout of a profile packed into a single structured array, which
+# is what gets shipped between processes and written to disk
+PROFILE_DTYPE = dtype([('time', float), ('heading', float),
+                       ('left_velocity', float), ('right_velocity', float),
+                       ('velocity', float), ('x', float), ('y', float),
+                       ('distance', float)])
+
+def json_object(time, heading, left_velocity, right_velocity):
+    # The saved form of a single planning point
+    return {"time": time,
+            "heading": heading,
+            "left velcoity": left_velocity,
+            "right velocity": right_velocity}
+
+def max_velocities(radius, robot):
+    # The fastest the center of the robot can go around a turn of the
+    # given radius without the outer wheel exceeding the max velocity.
+    # The radius is undefined (nan) where the path stops, at a waypoint
+    # with no velocity, which is treated as going straight
+    with errstate(divide='ignore', invalid='ignore'):
+        scale = 1 + robot.width/(2.*absolute(radius))
+    straight = (radius == 0) | isnan(radius)
+    return where(straight, robot.max_velocity, robot.max_velocity/scale)
+
+def wheel_velocities(radius, velocity, robot):
+    # Left and right wheel velocities when the center of the robot goes
+    # around a turn of the given radius at the given velocity, straight
+    # where the radius is undefined as in max_velocities
+    with errstate(divide='ignore', invalid='ignore'):
+        offset = where((radius == 0) | isnan(radius), 0,
+                       robot.width/(2.*radius))
+    return velocity*(1 - offset), velocity*(1 + offset)
+
+def _finite_curvature(curvature):
+    # The curvature with every undefined entry, where the path stops,
+    # replaced by the closest defined one, the next one if there is one
+    # and the previous one otherwise. The curvature where the robot is
+    # standing still only matters for the steps to and from it
+    bad = ~isfinite(curvature)
+    if not bad.any():
+        return curvature
+    good = flatnonzero(~bad)
+    if not len(good):
+        return zeros(len(curvature))
+    nearest = good[clip(searchsorted(good, flatnonzero(bad)), 0,
+                        len(good) - 1)]
+    curvature = curvature.copy()
+    curvature[bad] = curvature[nearest]
+    return curvature
+
+def adaptive_spacing(path, robot, distance, tolerance):
+    # Spacing for Path.planning_times which places the next point
+    # before the max velocity, or the share of it either wheel gets in a
+    # turn, has changed by more than tolerance. Points crowd together
+    # where the curvature changes quickly and spread out to distance
+    # apart on straights and steady turns. A step may not hide a dip in
+    # curvature either, like the one at every waypoint without any
+    # acceleration, since the profile would never see it. The path
+    # ahead is looked at in time rather than length, which needs no root
+    # finding, with the step converted using the local speed. Where the
+    # path stops, at a waypoint with no velocity, there's no speed to
+    # convert with, so the step is just distance
+    fractions = linspace(0, 1, LOOKAHEAD + 1)
+
+    def spacing(t):
+        speed = norm(path.tangent(t))
+        if speed == 0:
+            return distance
+        times = minimum(t + fractions*distance/speed, 1)
+        radius = path.curvature_radius_many(times)
+        caps = max_velocities(radius, robot)
+        left, _ = wheel_velocities(radius, robot.max_velocity, robot)
+        change = absolute(left - left[0])
+        variation = concatenate(([0.], cumsum(absolute(diff(left)))))
+        beyond = flatnonzero((absolute(caps - caps[0]) > tolerance) |
+                             (change > tolerance) |
+                             (variation - change > tolerance))
+        if not len(beyond):
+            return distance
+        return distance*max(beyond[0] - 1, 1)/LOOKAHEAD
+
+    return spacing
+
+# Times a stage of building a profile and reports when it starts and ends
+@contextmanager
+def _stage(stats, name, progress):
+    progress(name, 0.)
+    with stats.stage(name):
+        yield
+    progress(name, 1.)
+
+class SampledGeometry(object):
     # pylint: disable=too-many-instance-attributes
-    # planning points unfortunately require this much data
-
-    def __init__(self, position, time, radius, distance, heading):
-        # pylint: disable=bad-whitespace
-        # this next block is unreadable without the spacing
-
-        self.radius               = radius
-        self.heading         = heading
-        self.position        = position
-        self.distance        = distance
-        self.internal_time   = time
-        self.total_time      = None
-        self.external_time   = None
-        self.max_velocity    = None
-        self.left_velocity   = None
-        self.right_velocity  = None
-        self.actual_velocity = None
+    # every column of the geometry is its own attribute
 
-    def __str__(self):
-        return ("Planning Point: " + "\n" +
-                "Time: " + str(self.internal_time) + "\n" +
-                "Max Velocity: " + str(self.max_velocity) + "\n" +
-                "Velocity: " + str(self.actual_velocity) + "\n")
+    # The planning points of a path and everything about them that
+    # doesn't depend on the robot: their parameter on the path, the
+    # distance between them, their position, heading and curvature.
+    # Finding them is most of the work of a profile, so it's done once
+    # and shared by the profiles of every robot driving the path, see
+    # VelocityProfile.from_geometry. The profiles share these arrays
+    # rather than copy them, so they're read only.
+    # Adaptive spacing looks at the max velocity of a robot, so with a
+    # tolerance the robot placing the points is needed. Profiles of
+    # other robots can use the same points, but the tolerance is only
+    # kept for robots no wider or faster than that one, see
+    # fleet_profiles. stats is where the stage timings and work counts
+    # go, a new ProfileStats by default
+    def __init__(self, path, distance, progress=None, tolerance=None,
+                 robot=None, stats=None):
+        if tolerance is not None and robot is None:
+            raise ValueError("Adaptive spacing needs a robot")
+        self.path = path
+        self.distance = distance
+        self.tolerance = tolerance
+        self.robot = robot
+        # The number of splines the path had when it was sampled, so the
+        # points can still be placed on them after the path is spliced
+        self.segments = path.segments
+        if progress is None:
+            progress = default_progress()
+        self.stats = ProfileStats() if stats is None else stats
+        with collecting(self.stats):
+            with _stage(self.stats, "planning times", progress):
+                times, lengths = self.__planning_times(progress)
+            with _stage(self.stats, "geometry", progress):
+                self.__init_points(times, lengths)
 
-    def compute_max_velocity(self, robot):
-        if self.radius == 0:
-            velocity = robot.max_velocity
-        elif self.radius > 0:
-            velocity = (self.radius*robot.max_velocity)/(self.radius + (robot.width/2.))
-        else:
-            velocity = (self.radius*robot.max_velocity)/(self.radius - (robot.width/2.))
+    def __len__(self):
+        return len(self.times)
 
-        self.max_velocity = velocity
+    # The geometry after the path's splines from start up to stop were
+    # replaced by count new ones with Path.splice. Points on the other
+    # splines are kept as they are, only the gap between the last one
+    # before the change and the first one after it is sampled again, in
+    # equal steps at most distance long or adaptively with a tolerance.
+    # Returns the new geometry and the change, see __splice
+    def spliced(self, start, stop, count, progress=None, stats=None):
+        if progress is None:
+            progress = default_progress()
+        geometry = copy(self)
+        geometry.segments = self.path.segments
+        geometry.stats = ProfileStats() if stats is None else stats
+        with collecting(geometry.stats):
+            with _stage(geometry.stats, "planning times", progress):
+                kept, times, lengths = self.__resample(start, stop, count)
+                geometry.stats.count('resampled_points', len(times))
+            with _stage(geometry.stats, "geometry", progress):
+                change = geometry.__splice(self, kept, times, lengths)
+        return geometry, change
 
-    def compute_wheel_velocity(self, robot):
-        if self.actual_velocity is None:
-            velocity = self.max_velocity
+    # The points kept on either side of a splice, their times moved onto
+    # the spliced path, and the times and lengths of the new points
+    # between them
+    def __resample(self, start, stop, count):
+        # Each point as the spline it's on and its time along it, the
+        # splines after the change just moved by how many were added
+        index = minimum(floor(self.times*self.segments), self.segments - 1)
+        local = self.times*self.segments - index
+        head = flatnonzero(self.times < start/float(self.segments))
+        tail = flatnonzero(self.times > stop/float(self.segments))
+        index[tail] += count - (stop - start)
+        moved = (index + local)/float(self.path.segments)
+
+        if len(head):
+            low, t = self.lengths[head[-1]], moved[head[-1]]
+            lengths = []
+        else:
+            low, t = 0., 0.
+            lengths = [0.]
+        if len(tail):
+            high = self.path.lengths_at(moved[tail[:1]])[0]
         else:
-            velocity = self.actual_velocity
+            high = self.path.total_length
 
-        if self.radius == 0:
-            self.right_velocity = velocity
-            self.left_velocity = velocity
+        if self.tolerance is None:
+            steps = max(int(ceil((high - low)/self.distance - 1e-9)), 1)
+            lengths.extend(low + (high - low)*arange(1, steps)/float(steps))
+            if not len(tail):
+                lengths.append(high)
+            times = self.path.times_at_lengths(lengths).tolist()
         else:
-            self.right_velocity = velocity/self.radius*(self.radius+robot.width/2)
-            self.left_velocity = velocity/self.radius*(self.radius-robot.width/2)
+            spacing = adaptive_spacing(self.path, self.robot, self.distance,
+                                       self.tolerance)
+            times = [t] * len(lengths)
+            length = low + min(self.distance, spacing(t))
+            while length < high:
+                t = self.path.time_at_length(length)
+                lengths.append(length)
+                times.append(t)
+                length += min(self.distance, spacing(t))
+            if not len(tail):
+                lengths.append(high)
+                times.append(1.)
+        return (head, tail, moved, high), times, lengths
+
+    # Splices the new points between the ones kept from old, returning
+    # the change as (first, shift, settled): the index of the first new
+    # point, how far the points after the change moved, and the index of
+    # the last point whose distance from the one before it changed
+    def __splice(self, old, kept, times, lengths):
+        head, tail, moved, high = kept
+        with errstate(divide='ignore', invalid='ignore'):
+            new = self.path.geometry(times)
+        low = old.lengths[head[-1:]]
+        top = [high] if len(tail) else []
+        steps = diff(concatenate((low, lengths, top)))
+        if not len(head):
+            steps = concatenate(([0.], steps))
+        growth = high - old.lengths[tail[:1]].sum()
+
+        def join(column, middle):
+            return concatenate((column[head], middle, column[tail]))
+
+        self.times = join(moved, array(times, dtype=float))
+        self.lengths = join(old.lengths, array(lengths))
+        self.lengths[len(head) + len(lengths):] += growth
+        self.distances = concatenate((old.distances[head], steps,
+                                      old.distances[tail[1:]]))
+        self.radius = join(old.radius, new.radius)
+        self.position = concatenate((old.position[head],
+                                     new.position.reshape(-1, 2),
+                                     old.position[tail]))
+        self.heading = join(old.heading, new.heading)
+        self.curvature = join(old.curvature, self.__curvature(new.radius))
+
+        first = len(head)
+        shift = len(lengths) - (len(old) - len(head) - len(tail))
+        settled = first + len(lengths) if len(tail) else len(self) - 1
+        return first, shift, settled
+
+    @staticmethod
+    def __curvature(radius):
+        with errstate(divide='ignore'):
+            return where(radius == 0, 0, 1/radius)
+
+    # Progress is only reported every PROGRESS_STEPS-th of the way, so
+    # the callback costs nothing next to the arc length queries
+    def __planning_times(self, progress):
+        spacing = None
+        if self.tolerance is not None:
+            spacing = adaptive_spacing(self.path, self.robot, self.distance,
+                                       self.tolerance)
+        times = []
+        report = 1./PROGRESS_STEPS
+        for t in self.path.planning_times(self.distance, spacing):
+            times.append(t)
+            if report <= t < 1:
+                progress("planning times", t)
+                report = t + 1./PROGRESS_STEPS
+        # The lengths up to every point are found at once, the distance
+        # between points is how much they grow
+        return times, self.path.lengths_at(times)
+
+    # The curvature, and everything derived from it, is undefined where
+    # the path stops, which max_velocities and _finite_curvature handle
+    def __init_points(self, times, lengths):
+        with errstate(divide='ignore', invalid='ignore'):
+            geometry = self.path.geometry(times)
+        self.times = array(times, dtype=float)
+        self.lengths = lengths
+        self.distances = concatenate(([0.], diff(lengths)))
+        self.radius = geometry.radius
+        self.position = geometry.position
+        self.heading = geometry.heading
+        self.curvature = self.__curvature(self.radius)
+
+def fleet_profiles(path, robots, distance, progress=None, tolerance=None):
+    # Profiles of the same path for many robots, all sharing one
+    # SampledGeometry. With a tolerance the points are placed for a
+    # robot as wide and as fast as the widest and fastest of them, which
+    # crowds them at least as closely as any one of them would
+    if tolerance is None:
+        spacing = None
+    else:
+        spacing = Robot(max(robot.width for robot in robots),
+                        max(robot.max_velocity for robot in robots),
+                        max(robot.max_acceleration for robot in robots))
+    geometry = SampledGeometry(path, distance, progress, tolerance, spacing)
+    return [VelocityProfile.from_geometry(geometry, robot, progress)
+            for robot in robots]
+
+def _column(name):
+    # A property reading and writing one entry of a profile column
+    def fget(point):
+        return getattr(point.profile, name)[point.index]
+
+    def fset(point, value):
+        getattr(point.profile, name)[point.index] = value
+
+    return property(fget, fset)
+
+class PlanningPoint(object):
+    # A lightweight view of a single row of a VelocityProfile, kept so
+    # code that works point by point still can. It holds no data of
+    # its own, everything is read from and written to the columns
+
+    __slots__ = ('profile', 'index')
+
+    def __init__(self, profile, index):
+        self.profile = profile
+        self.index = index
+
+    radius = _column('radius')
+    heading = _column('heading')
+    position = _column('position')
+    distance = _column('distances')
+    internal_time = _column('internal_time')
+    external_time = _column('external_time')
+    max_velocity = _column('max_velocity')
+    actual_velocity = _column('actual_velocity')
+    left_velocity = _column('left_velocity')
+    right_velocity = _column('right_velocity')
+
+    def __str__(self):
+        return ("Planning Point: " + "\n" +
+                "Time: " + str(self.internal_time) + "\n" +
+                "Max Velocity: " + str(self.max_velocity) + "\n" +
+                "Velocity: " + str(self.actual_velocity) + "\n")
 
     def json_object(self):
-        return {"time": self.external_time,
-                "heading": self.heading,
-                "left velcoity": self.left_velocity,
-                "right velocity": self.right_velocity}
+        return json_object(self.external_time, self.heading,
+                           self.left_velocity, self.right_velocity)
 
 class VelocityProfile(object):
-    def __init__(self, path, robot, distance):
+    # pylint: disable=too-many-instance-attributes
+    # every column of the profile is its own attribute
+
+    # progress is called with the stage name and the fraction of it
+    # done, see the progress module. By default a bar is drawn when
+    # stdout is a terminal and nothing is printed otherwise.
+    # Without a tolerance planning points are distance apart. With one
+    # they are at most distance apart and placed so the max velocity
+    # changes by no more than tolerance from one to the next.
+    # The planning points come from geometry if it's given, a
+    # SampledGeometry of the same path, distance and tolerance, and are
+    # found from scratch otherwise
+    def __init__(self, path, robot, distance, progress=None,
+                 tolerance=None, geometry=None):
         self.path = path
         self.robot = robot
         self.distance = distance
-        self.points = []
-        self.__init_points()
-        #broken
-        #self.__establish_accel()
-        # Dirty Hack
-        actual_max_accel = self.robot.max_acceleration
-        current_max_accel = float('inf')
-        while current_max_accel > actual_max_accel:
-            print "Ensuring Consitency of Wheels"
-            self.__forward_consistency(0)
-            self.__reverse_consistency(0)
+        self.tolerance = tolerance
+        self.total_time = None
+        if progress is None:
+            progress = default_progress()
+        # Where the time went, see the instrument module
+        self.stats = ProfileStats()
+        with collecting(self.stats):
+            if geometry is None:
+                geometry = SampledGeometry(path, distance, progress,
+                                           tolerance, robot, self.stats)
+            self.__solve(geometry, progress)
+
+    # The profile of a robot over planning points that were already
+    # found, which skips straight to the cheap velocity passes
+    @classmethod
+    def from_geometry(cls, geometry, robot, progress=None):
+        return cls(geometry.path, robot, geometry.distance, progress,
+                   geometry.tolerance, geometry)
+
+    # The profile after the path's splines from start up to stop were
+    # replaced by count new ones with Path.splice, e.g. when a waypoint
+    # moved. Only the planning points on the new splines are found
+    # again (see SampledGeometry.spliced) and the consistency passes
+    # only revisit the points the change can reach, so the cost depends
+    # on the size of the change rather than the length of the path.
+    # This profile is left as it was
+    def spliced(self, start, stop, count, progress=None):
+        if progress is None:
+            progress = default_progress()
+        profile = copy(self)
+        profile.stats = ProfileStats()
+        with collecting(profile.stats):
+            geometry, change = self.geometry.spliced(start, stop, count,
+                                                     progress, profile.stats)
+            profile.__solve(geometry, progress, self, change)
+        return profile
+
+    # Finds the velocities over the geometry's planning points, reusing
+    # the passes of previous where the change to the points since then
+    # can't be felt, see the consistency passes
+    def __solve(self, geometry, progress, previous=None, change=None):
+        self.geometry = geometry
+        with _stage(self.stats, "limits", progress):
+            self.__init_points()
+            self.__init_limits()
+        with _stage(self.stats, "forward consistency", progress):
+            resumed = self.__forward_consistency(0, previous, change)
+        with _stage(self.stats, "reverse consistency", progress):
+            self.__reverse_consistency(0, previous, change, resumed)
+        with _stage(self.stats, "timestamps", progress):
             self.__establish_timestamps()
+        with _stage(self.stats, "wheel velocities", progress):
             self.__init_wheels()
-            current_max_accel = self.__get_max_accel()
-            self.robot.max_acceleration = 3./4 * self.robot.max_acceleration
 
+    def __len__(self):
+        return len(self.internal_time)
+
+    # A view of every row of the profile, for code that wants to walk
+    # the planning points one at a time
+    @property
+    def points(self):
+        return [PlanningPoint(self, index) for index in range(len(self))]
+
+    # The geometric columns are the geometry's own arrays, only the
+    # columns depending on the robot are new
     def __init_points(self):
-        print "Initializing Planning Points..."
-        last_t = 0
-        steps = ceil(self.path.total_length/self.distance)
-        step = 1
-        progress = 0
-        for t in self.path.planning_times(self.distance):
-            print '\r[{0}{1}] {2}%'.format('#'*int(progress * 30),
-                                           '-'*(int((1-progress) * 30)),
-                                           int(progress*100)),
-            radius = self.path.curvature_radius(t)
-            distance = self.path.length(last_t, t)
-            position = self.path.eval(t)
-            heading = self.path.heading(t)
-            point = PlanningPoint(position, t, radius, distance, heading)
-            point.compute_max_velocity(self.robot)
-            point.compute_wheel_velocity(self.robot)
-            self.points.append(point)
-            last_t = t
-            step += 1
-            progress = step/steps
-        print "Done!"
-
-    def __forward_consistency(self, initial_velocity):
-        print "Establishing Forward Consistency..."
-        last_velocity = None
-        for point in self.points:
-            if last_velocity is None:
-                point.actual_velocity = min(initial_velocity, point.max_velocity)
-            else:
-                obtainable = sqrt(last_velocity**2+2*self.robot.max_acceleration*point.distance)
-                point.actual_velocity = min(point.max_velocity, obtainable)
-            last_velocity = point.actual_velocity
-        print "Done!"
-
-    def __reverse_consistency(self, final_velocity):
-        print "Establishing Reverse Consistency..."
-        last_velocity = None
-        last_distance = None
-        for point in reversed(self.points):
-            if last_velocity is None:
-                point.actual_velocity = min(final_velocity, point.actual_velocity)
-            else:
-                obtainable = sqrt(last_velocity**2+2*self.robot.max_acceleration*last_distance)
-                point.actual_velocity = min(point.actual_velocity, obtainable)
+        geometry = self.geometry
+        self.internal_time = geometry.times
+        self.distances = geometry.distances
+        self.radius = geometry.radius
+        self.position = geometry.position
+        self.heading = geometry.heading
+        self.external_time = zeros(len(geometry))
+        self.actual_velocity = zeros(len(geometry))
+        self.max_velocity = max_velocities(self.radius, self.robot)
+        self.left_velocity, self.right_velocity = \
+            wheel_velocities(self.radius, self.max_velocity, self.robot)
 
-            last_distance = point.distance
-            last_velocity = point.actual_velocity
-        print "Done!"
+    # Over the step from point j to point i the velocity of a wheel is
+    # k times the velocity of the center, with k = 1 -+ (width/2)/radius
+    # for the left and right wheel. With trapezoidal timestamps the
+    # wheel's acceleration over the step is exactly
+    #   k_avg*(v_i**2 - v_j**2)/(2*ds) + v_avg**2*(k_i - k_j)/ds
+    # so both wheels stay within the max acceleration a whenever
+    #   scale*|v_i**2 - v_j**2| + change*(v_i**2 + v_j**2) <= 2*a*ds
+    # where scale bounds |k_avg| for both wheels and change = |k_i - k_j|.
+    # This is linear in the squared velocities, so one forward and one
+    # backward pass over it finds the fastest valid profile, no matter
+    # how far the robot's acceleration is from what the wheels allow.
+    def __init_limits(self):
+        half_width = self.robot.width/2.
+        curvature = _finite_curvature(self.geometry.curvature)
+        scale = 1 + half_width*absolute(curvature[1:] + curvature[:-1])/2.
+        change = half_width*absolute(diff(curvature))
+        budget = 2*self.robot.max_acceleration*self.distances[1:]
 
-    def __establish_timestamps(self):
-        print "Establishing Timestamps..."
-        last_time = None
-        last_velocity = None
-        for point in self.points:
-            if last_time is None:
-                point.external_time = 0
+        # The change in curvature alone asks the wheels to accelerate,
+        # which caps the squared velocity at both ends of a step
+        with errstate(divide='ignore'):
+            cruise = where(change == 0, inf, budget/(2*change))
+        caps = self.max_velocity**2
+        caps[1:] = minimum(caps[1:], cruise)
+        caps[:-1] = minimum(caps[:-1], cruise)
+
+        self.__scale = [None] + scale.tolist()
+        self.__change = [None] + change.tolist()
+        self.__budget = [None] + budget.tolist()
+        self.__cruise = [None] + cruise.tolist()
+        self.__caps = caps.tolist()
+
+    # Largest squared velocity at one end of step i given the squared
+    # velocity at the other end. When the curvature changes faster than
+    # the wheels could follow the cruise cap is already the binding limit
+    def __reach(self, step, squared_velocity):
+        scale = self.__scale[step]
+        change = self.__change[step]
+        if scale < change:
+            return self.__cruise[step]
+        return (self.__budget[step] + (scale - change)*squared_velocity) / \
+               (scale + change)
+
+    # The consistency passes are inherently sequential, so they run over
+    # plain lists of squared velocities and write the column back once.
+    # Given the passes of a previous profile and the change to the
+    # planning points since, (first, shift, settled) from
+    # SampledGeometry.spliced, a pass starts where the change is first
+    # felt. Once it's past the last changed step and agrees with the
+    # previous pass every point after would agree too, so the rest is
+    # copied. Returns the index the copying started from, if it did
+    def __forward_consistency(self, initial_velocity, previous=None,
+                              change=None):
+        squared = []
+        start = 0
+        if previous is not None:
+            first, shift, settled = change
+            # The cap of the point before the first new one depends on
+            # the step to it
+            start = max(first - 1, 0)
+            old = previous.__forward
+            squared = old[:start]
+        reductions = 0
+        resumed = None
+        for index in range(start, len(self.__caps)):
+            cap = self.__caps[index]
+            if index == 0:
+                value = min(initial_velocity**2, cap)
             else:
-                dt = (2*point.distance)/(point.actual_velocity + last_velocity)
-                point.external_time = last_time + dt
+                obtainable = self.__reach(index, squared[-1])
+                if obtainable < cap:
+                    reductions += 1
+                value = min(cap, obtainable)
+            squared.append(value)
+            if previous is not None and index > settled and \
+               value == old[index - shift]:
+                squared.extend(old[index - shift + 1:])
+                resumed = index
+                break
+        self.__forward = squared
+        self.stats.count('acceleration_reductions', reductions)
+        self.stats.count('consistency_steps', len(squared) - start
+                         if resumed is None else resumed + 1 - start)
+        return resumed
+
+    # Going backwards the points from where the forward pass resumed
+    # copying on are the same as before, and once the pass is before the
+    # first new point and agrees with the previous one it can stop
+    def __reverse_consistency(self, final_velocity, previous=None,
+                              change=None, resumed=None):
+        squared = list(self.__forward)
+        last = len(squared) - 1
+        if previous is not None:
+            first, shift, _ = change
+            old = previous.__squared
+        if resumed is None:
+            squared[last] = min(final_velocity**2, squared[last])
+            start = last
+        else:
+            squared[resumed:] = old[resumed - shift:]
+            start = resumed
+        reductions = 0
+        steps = 0
+        for index in reversed(range(start)):
+            steps += 1
+            obtainable = self.__reach(index + 1, squared[index + 1])
+            if obtainable < squared[index]:
+                reductions += 1
+                squared[index] = obtainable
+            if previous is not None and index < first and \
+               squared[index] == old[index]:
+                squared[:index] = old[:index]
+                break
+        self.__squared = squared
+        self.actual_velocity = array(squared)**0.5
+        self.stats.count('deceleration_reductions', reductions)
+        self.stats.count('consistency_steps', steps)
 
-            last_time = point.external_time
-            last_velocity = point.actual_velocity
-        self.total_time = last_time
-        print "Done!"
+    def __establish_timestamps(self):
+        velocity = self.actual_velocity
+        dt = (2*self.distances[1:])/(velocity[1:] + velocity[:-1])
+        self.external_time = concatenate(([0.], cumsum(dt)))
+        self.total_time = self.external_time[-1]
 
     def __init_wheels(self):
-        print "Computing Wheel Velocities..."
-        for point in self.points:
-            point.compute_wheel_velocity(self.robot)
-        print "Done!"
-
-    def __get_max_accel(self):
-        last_point = None
-        max_accel = 0
-        for point in self.points:
-            if last_point is None:
-                last_point = point
-            else:
-                dt = point.external_time - last_point.external_time
-                left_accel = (abs(point.left_velocity -
-                                  last_point.left_velocity))/dt
-                right_accel = (abs(point.right_velocity -
-                                   last_point.right_velocity))/dt
-                max_accel = max(max_accel, left_accel, right_accel)
-        return max_accel
+        self.left_velocity, self.right_velocity = \
+            wheel_velocities(self.radius, self.actual_velocity, self.robot)
+
+    # The profile packed into one structured array with a row per
+    # planning point, see PROFILE_DTYPE
+    def as_array(self):
+        table = empty(len(self), PROFILE_DTYPE)
+        table['time'] = self.external_time
+        table['heading'] = self.heading
+        table['left_velocity'] = self.left_velocity
+        table['right_velocity'] = self.right_velocity
+        table['velocity'] = self.actual_velocity
+        table['x'] = self.position[:, 0]
+        table['y'] = self.position[:, 1]
+        table['distance'] = self.distances
+        return table
+
+    # The largest acceleration asked of either wheel between two
+    # consecutive planning points
+    def max_wheel_acceleration(self):
+        if len(self) < 2:
+            return 0
+        dt = diff(self.external_time)
+        left_accel = absolute(diff(self.left_velocity))/dt
+        right_accel = absolute(diff(self.right_velocity))/dt
+        return max(left_accel.max(), right_accel.max())
 
 class ProfileEncoder(json.JSONEncoder):
     # pylint: disable=arguments-differ
@@ -177,5 +612,9 @@ class ProfileEncoder(json.JSONEncoder):
             for point in obj.points:
                 output.append(point.json_object())
             return output
+        if isinstance(obj, ndarray) and obj.dtype == PROFILE_DTYPE:
+            return [json_object(row['time'], row['heading'],
+                                row['left_velocity'], row['right_velocity'])
+                    for row in obj]
         # This will throw an error if it's given the wrong type
         return json.JSONEncoder.default(self, obj)
@@ -4,12 +4,18 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import seaborn as sns
 
+from numpy import linspace, concatenate, empty
+
+# Number of times each spline of a path is sampled at when drawn
+SAMPLES_PER_SPLINE = 200
+
+def split_points(points):
+    if len(points):
+        return points[:, 0], points[:, 1]
+    return [], []
+
 def plot_pairs(canvas, points, fstring=""):
-    if points:
-        x, y = zip(*points)
-    else:
-        x = []
-        y = []
+    x, y = split_points(points)
 
     if fstring == "":
         return canvas.plot(x, y)
@@ -17,20 +23,70 @@ def plot_pairs(canvas, points, fstring=""):
     return canvas.plot(x, y, fstring)
 
 def update_data(line, points):
-    if points:
-        x, y = zip(*points)
-    else:
-        x = []
-        y = []
-
+    x, y = split_points(points)
     line.set_xdata(x)
     line.set_ydata(y)
 
+# Remembers the sampled center line and wheel curves of every spline
+# drawn, so redrawing a path only samples the splines that changed.
+# Splines are never modified once built, editing a path swaps in new
+# ones, so a spline object is its own cache key
+class CurveCache(object):
+
+    def __init__(self):
+        self.centers = {}
+        self.wheels = {}
+
+    def __center(self, spline, times):
+        if spline not in self.centers:
+            self.centers[spline] = spline.eval_many(times)
+        return self.centers[spline]
+
+    def __wheels(self, spline, times, offset):
+        key = (spline, offset)
+        if key not in self.wheels:
+            center = self.__center(spline, times)
+            normal = spline.unit_normal_many(times)*offset
+            self.wheels[key] = (center + normal, center - normal)
+        return self.wheels[key]
+
+    # Drops everything not belonging to the given splines and offset
+    def __prune(self, splines, offset):
+        keep = set(splines)
+        for spline in list(self.centers):
+            if spline not in keep:
+                del self.centers[spline]
+        for key in list(self.wheels):
+            if key[0] not in keep or key[1] != offset:
+                del self.wheels[key]
+
+    # The center, left and right curves of the path as arrays of points,
+    # the wheel curves are empty without an offset
+    def sample(self, path, offset=0):
+        if path is None:
+            nothing = empty((0, 2))
+            return nothing, nothing, nothing
+
+        times = linspace(0, 1, SAMPLES_PER_SPLINE)
+        self.__prune(path.splines, offset)
+        center = concatenate([self.__center(spline, times)
+                              for spline in path.splines])
+        if not offset:
+            nothing = empty((0, 2))
+            return center, nothing, nothing
+
+        wheels = [self.__wheels(spline, times, offset)
+                  for spline in path.splines]
+        left = concatenate([pair[0] for pair in wheels])
+        right = concatenate([pair[1] for pair in wheels])
+        return center, left, right
+
 class Visualizer(object):
 
     def __init__(self, path, offset=0):
         sns.set()
-        self.curve_data = []
+        self.curves = CurveCache()
+        self.__drawn = None
         plt.show()
         self.fig1 = plt.figure(1)
         gridspec.GridSpec(3, 3)
@@ -46,64 +102,36 @@ class Visualizer(object):
     def show():
         plt.show(block=False)
 
+    # What the drawn path looks like, the splines and offset
+    @staticmethod
+    def __state(path, offset):
+        splines = () if path is None else tuple(path.splines)
+        return splines, offset
+
     def update_path(self, path, offset=0):
-        if path is None:
-            update_data(self.path_lines["left"], [])
-            update_data(self.path_lines["right"], [])
-            update_data(self.path_lines["center"], [])
-
-        else:
-            points = []
-            for t in range(1000):
-                points.append(path.eval(t/1000.0))
-
-            if offset:
-                lpoints = []
-                rpoints = []
-                for t in range(1000):
-                    pos = path.eval(t/1000.)
-                    normal = path.unit_normal(t/1000.)
-                    lpoints.append(pos+normal*offset)
-                    rpoints.append(pos-normal*offset)
-                update_data(self.path_lines["left"], lpoints)
-                update_data(self.path_lines["right"], rpoints)
-
-            update_data(self.path_lines["center"], points)
+        # Robot commands update the path without changing it
+        state = self.__state(path, offset)
+        if state == self.__drawn:
+            return
+        self.__drawn = state
+
+        center, left, right = self.curves.sample(path, offset)
+        update_data(self.path_lines["center"], center)
+        update_data(self.path_lines["left"], left)
+        update_data(self.path_lines["right"], right)
 
         plt.draw()
 
     @staticmethod
     def draw_spline(spline, canvas):
-        points = []
-        for t in range(1000):
-            points.append(spline.eval(t/1000.0))
-
-        plot_pairs(points, canvas)
-
-    @staticmethod
-    def draw_path(path, canvas, offset=0):
-        if path is None:
-            center = plot_pairs(canvas, [])
-            left = plot_pairs(canvas, [], 'r--')
-            right = plot_pairs(canvas, [], 'r--')
-        else:
-            points = []
-            for t in range(1000):
-                points.append(path.eval(t/1000.0))
-
-            if offset:
-                lpoints = []
-                rpoints = []
-                for t in range(1000):
-                    pos = path.eval(t/1000.)
-                    normal = path.unit_normal(t/1000.)
-                    lpoints.append(pos+normal*offset)
-                    rpoints.append(pos-normal*offset)
-                left = plot_pairs(canvas, lpoints, 'r--')
-                right = plot_pairs(canvas, rpoints, 'r--')
-
-            center = plot_pairs(canvas, points)
-
+        plot_pairs(canvas, spline.eval_many(linspace(0, 1, 1000)))
+
+    def draw_path(self, path, canvas, offset=0):
+        self.__drawn = self.__state(path, offset)
+        center, left, right = self.curves.sample(path, offset)
+        center = plot_pairs(canvas, center)
+        left = plot_pairs(canvas, left, 'r--')
+        right = plot_pairs(canvas, right, 'r--')
         return center + left + right
 
     def draw_velocity_profile(self, velocity_profile):
@@ -123,10 +151,7 @@ class Visualizer(object):
     def __draw_curve(self, profile, canvas, planning=False):
         self.draw_path(profile.path, canvas, profile.robot.width/2.)
         if planning:
-            points = []
-            for point in profile.points:
-                points.append(point.position)
-            plot_pairs(canvas, points, 'r.')
+            plot_pairs(canvas, profile.position, 'r.')
         canvas.axis('equal')
 
     @staticmethod
@@ -160,17 +185,8 @@ class Visualizer(object):
         canvas.plot(times, left_velocities, label="Left Wheel")
         canvas.plot(times, right_velocities, label="Right Wheel")
 
-    @staticmethod
-    def __draw_wheel_paths(profile, canvas):
-        right_points = []
-        left_points = []
-        for t in range(100):
-            pos = profile.path.eval(t/100.)
-            normal = profile.path.unit_normal(t/100.)
-            left = pos + normal * profile.robot.width/2.
-            right = pos - normal * profile.robot.width/2.
-            right_points.append(right)
-            left_points.append(left)
-
-        plot_pairs(canvas, left_points, 'r--')
-        plot_pairs(canvas, right_points, 'r--')
+    def __draw_wheel_paths(self, profile, canvas):
+        _, left, right = self.curves.sample(profile.path,
+                                            profile.robot.width/2.)
+        plot_pairs(canvas, left, 'r--')
+        plot_pairs(canvas, right, 'r--')